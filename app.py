@@ -5,18 +5,35 @@ from server.property_handlers import register_property_handlers
 from server.market_handlers import register_market_handlers
 from server.analysis_handlers import register_analysis_handlers
 from server.input_handlers import register_input_handlers
+from server.helpers import sidebar_filters, result_limit, present
 from services.property_service import PropertyService
 from services.market_service import MarketService
 from services.scoring_service import ScoringService
-from models.property import Property
+from models.property import PROPERTY_TYPE_MAP
 import pandas as pd
+import numpy as np
 from pathlib import Path
 from create_db import create_db
+from db_schema import MISSING_ZIPCODE_TEXT
+from scoring_kernel import cap_rates
 from shiny import reactive
+from starlette.responses import JSONResponse
+import logging
+import time
+from functools import lru_cache
+
+log = logging.getLogger(__name__)
+
+# Seconds the range inputs must stay unchanged before they are validated
+VALIDATION_DELAY = 0.25
+
+# Build the database from the CSV (when it changed) before any service opens it
+create_db("lotwize_case.csv")
 
 # Initialize services
 property_service = PropertyService()
 market_service = MarketService()
+market_service.prepare_tables()
 scoring_service = ScoringService()
 
 # Create UI components
@@ -26,6 +43,11 @@ main_panel = MainPanel()
 app_ui = ui.page_fluid(
     ui.tags.head(
         ui.tags.link(rel="stylesheet", href="styles.css"),
+        # Plotly is loaded once here; figures are rendered with include_plotlyjs=False
+        ui.tags.script(src="https://cdn.plot.ly/plotly-2.35.2.min.js"),
+        # deck.gl draws the property heatmap
+        ui.tags.script(src="https://unpkg.com/deck.gl@9.0.38/dist.min.js"),
+        ui.tags.script(src="heatmap.js"),
     ),
     ui.div(
         {"class": "header"},
@@ -40,143 +62,145 @@ app_ui = ui.page_fluid(
     )
 )
 
-def calculate_investment_score(property: Property) -> float:
-    """Calculate an investment score from 0-10"""
-    score = 0
-    
-    # Cap rate score (0-4 points)
-    if property.price > 0:
-        cap_rate = (property.rent_estimate * 12) / property.price
-        score += min(cap_rate * 40, 4)
-    
-    # Appreciation potential (0-3 points)
-    if property.price > 0:
-        appreciation = (property.zestimate - property.price) / property.price
-        score += min(appreciation * 10, 3)
-    
-    # Property age (0-2 points)
-    if property.year_built:
-        age_score = min((2023 - property.year_built) / 100, 1)
-        score += 2 * (1 - age_score)
-    
-    # HOA consideration (0-1 point)
-    if not property.monthly_hoa or property.monthly_hoa < 200:
-        score += 1
-    
-    return score
+# Display names for the standardized property types
+_TYPE_MAP = {variant: standard.title() for variant, standard in PROPERTY_TYPE_MAP.items()}
 
-def safe_format_address(address, city, state, zipcode):
-    """Safely format address components"""
-    parts = []
-    if address and str(address).strip() != 'Address Not Available':
-        parts.append(str(address))
-    if city and str(city).strip() != 'City Not Available':
-        parts.append(str(city))
-    if state and str(state).strip() != 'NA':
-        parts.append(str(state))
-    if zipcode and str(zipcode).strip() != '00000':
-        parts.append(str(zipcode))
-    return ' '.join(parts) if parts else 'Address Not Available'
+# Rows shown in the opportunities table
+TABLE_ROWS = 50
+
+OPPORTUNITY_COLUMNS = [
+    'Address', 'City', 'State', 'ZIP', 'Price', 'Fair Price', 'Price Diff', 'Type', 
+    'Beds/Baths', 'Sqft', 'Year Built', 'Cap Rate', 
+    'Monthly Rent', 'HOA', 'Appreciation', 'Investment Score', 'Location'
+]
+
+# Zoom level the heatmap is binned for until the browser reports one
+DEFAULT_MAP_ZOOM = 11
+
+@lru_cache(maxsize=32)
+def render_heatmap(center, metric, points_bytes, details_url, zoom=DEFAULT_MAP_ZOOM):
+    """Heatmap HTML for a float32 [lat, lon, weight, score] buffer binned for the zoom level;
+    identical inputs are served from the cache"""
+    return MainPanel.create_heatmap(center, np.frombuffer(points_bytes, dtype=np.float32), metric, details_url, zoom)
+
+def format_column(values, fmt, na="N/A"):
+    """Format every non-missing value of a column with fmt, using na for missing values"""
+    return pd.Series(values).map(fmt.format, na_action='ignore').fillna(na)
+
+def _address_part(values, *sentinels):
+    """Address component as text, blank when missing or set to one of its placeholder values"""
+    text = values.astype(str).str.strip()
+    return text.where(values.notna() & ~text.isin(sentinels) & text.ne(''), '')
+
+def format_addresses(df: pd.DataFrame) -> pd.Series:
+    """Join address components, skipping placeholder values"""
+    joined = (
+        _address_part(df['address'], 'Address Not Available') + ' ' +
+        _address_part(df['city'], 'City Not Available') + ' ' +
+        _address_part(df['state'], 'NA') + ' ' +
+        _address_part(df['zipcode'], *MISSING_ZIPCODE_TEXT)
+    ).str.replace(r'\s+', ' ', regex=True).str.strip()
+    return joined.where(joined.ne(''), 'Address Not Available')
 
 def server(input, output, session):
+    # Property details for the heatmap tooltips (one list per field), served to the browser on the first hover
+    heatmap_details = {}
+    heatmap_details_url = session.dynamic_route("heatmap_details", lambda request: JSONResponse(heatmap_details))
+    # Zoom level reported by www/heatmap.js, so the heatmap cells are re-binned as the user zooms
+    map_zoom = reactive.Value(DEFAULT_MAP_ZOOM)
+    
+    @reactive.Effect
+    @reactive.event(input.map_zoom)
+    def _track_map_zoom():
+        map_zoom.set(int(input.map_zoom()))
+    
     # Register all handlers
     register_property_handlers(input, output, session, property_service, scoring_service, market_service)
     register_market_handlers(input, output, session, market_service)
     register_analysis_handlers(input, output, session, property_service, scoring_service)
     register_input_handlers(input, session)
 
-    @output
-    @render.table
-    def opportunities_table():
+    @reactive.Calc
+    def _filters():
+        """Current sidebar filters, shared by the table and the heatmap"""
+        return sidebar_filters(input)
+
+    @reactive.Calc
+    def _map_limit():
+        """Number of top properties the heatmap considers, from the sidebar"""
+        return result_limit(_filters(), input.top_n())
+
+    @reactive.Calc
+    def current_properties():
+        """Query once per refresh/filter change, enough rows for both the table and the heatmap"""
         # Force reactivity on refresh button
         input.refresh_dashboard()
         
-        # Get current filters from sidebar
-        selected_types = input.property_types()
-        print(f"Selected property types (raw input): {selected_types}")  # Debug print
-        
-        filters = {
-            'price_min': input.price_min() or 100000,
-            'price_max': input.price_max() or 2000000,
-            'property_types': selected_types,  # Pass through directly
-            'sqft_min': input.sqft_min() or 500,
-            'sqft_max': input.sqft_max() or 5000,
-            'location': input.location() if input.location() and input.location().strip() else None,
-            'max_hoa': None
-        }
-        
-        print(f"Filters being passed to service: {filters}")  # Debug print
-        
+        filters = _filters()
+        log.debug("Filters being passed to service: %s", filters)
+        return property_service.get_investment_opportunities_df('score', max(TABLE_ROWS, _map_limit()), filters)
+
+    @output
+    @render.table
+    def opportunities_table():
         try:
-            properties = property_service.get_investment_opportunities(sort_by='score', limit=50, filters=filters)
-            print(f"Retrieved {len(properties)} properties")  # Debug print
-            if properties:
-                print("Sample property types:", [p.property_type for p in properties[:5]])  # Debug print
+            props = current_properties().head(TABLE_ROWS)
+            log.debug("Retrieved %d properties", len(props))
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("Sample property types: %s", props['property_type'].head(5).tolist())
             
-            # Create a list of dictionaries for the DataFrame
-            data = []
-            for p in properties:
-                try:
-                    formatted_address = safe_format_address(p.address, p.city, p.state, p.zipcode)
-                    # Safe value formatting with error handling
-                    def safe_format(value, format_func):
-                        try:
-                            return format_func(value) if value is not None else "N/A"
-                        except:
-                            return "N/A"
-                    
-                    # Calculate price difference and percentage
-                    price_diff = p.fair_price - p.price if p.fair_price and p.price else None
-                    price_diff_pct = (price_diff / p.price * 100) if price_diff is not None and p.price else None
-                    
-                    # Calculate cap rate and appreciation safely
-                    cap_rate = (p.rent_estimate * 12 / p.price * 100) if p.price and p.rent_estimate else None
-                    appreciation = ((p.zestimate - p.price) / p.price * 100) if p.price and p.zestimate else None
-                    
-                    # Clean up and standardize property type display
-                    property_type = 'Unknown'
-                    if p.property_type:
-                        cleaned_type = p.property_type.strip().upper()
-                        # Map common variations to standard names
-                        type_mapping = {
-                            'SINGLE FAMILY': 'Single Family',
-                            'SINGLE-FAMILY': 'Single Family',
-                            'SINGLEFAMILY': 'Single Family',
-                            'CONDO': 'Condo',
-                            'CONDOMINIUM': 'Condo',
-                            'TOWNHOUSE': 'Townhouse',
-                            'TOWN_HOUSE': 'Townhouse',
-                            'MULTI-FAMILY': 'Multi-Family',
-                            'MULTI FAMILY': 'Multi-Family',
-                            'LAND': 'Land'
-                        }
-                        property_type = type_mapping.get(cleaned_type, cleaned_type.title())
-                    
-                    data.append({
-                        'Address': formatted_address,
-                        'City': p.city or 'N/A',
-                        'State': p.state or 'N/A',
-                        'ZIP': p.zipcode or 'N/A',
-                        'Price': safe_format(p.price, lambda x: f"${x:,.0f}"),
-                        'Fair Price': safe_format(p.fair_price, lambda x: f"${x:,.0f}"),
-                        'Price Diff': f"${price_diff:+,.0f} ({price_diff_pct:+.1f}%)" if price_diff is not None else 'N/A',
-                        'Type': property_type,
-                        'Beds/Baths': f"{p.bedrooms or 0}/{p.bathrooms or 0}",
-                        'Sqft': safe_format(p.living_area, lambda x: f"{x:,.0f}"),
-                        'Year Built': safe_format(p.year_built, lambda x: f"{int(x)}"),
-                        'Cap Rate': safe_format(cap_rate, lambda x: f"{x:.1f}%"),
-                        'Monthly Rent': safe_format(p.rent_estimate, lambda x: f"${x:,.0f}"),
-                        'HOA': safe_format(p.monthly_hoa, lambda x: f"${x:,.0f}"),
-                        'Appreciation': safe_format(appreciation, lambda x: f"{x:.1f}%"),
-                        'Investment Score': safe_format(calculate_investment_score(p), lambda x: f"{x:.1f}"),
-                        'Location': ui.HTML(f'<a href="https://www.google.com/maps/search/?api=1&query={formatted_address.replace(" ", "+")}" target="_blank" class="map-link">🗺️ View</a>') if formatted_address != 'Address Not Available' else 'N/A'
-                    })
-                except Exception as row_error:
-                    print(f"Error processing row: {str(row_error)}")
-                    continue
+            if props.empty:
+                return pd.DataFrame(columns=OPPORTUNITY_COLUMNS)
             
-            # Convert to DataFrame
-            df = pd.DataFrame(data)
+            # Build the table column-at-a-time from the raw result columns
+            price = props['price']
+            fair_price = props['fair_price']
+            rent = props['rent_estimate']
+            zestimate = props['zestimate']
+            has_price = present(price)
+            
+            # Calculate price difference and percentage
+            price_diff = (fair_price - price).where(present(fair_price) & has_price)
+            price_diff_pct = price_diff / price * 100
+            
+            # Calculate cap rate and appreciation safely
+            cap_rate = (rent * 12 / price * 100).where(has_price & present(rent))
+            appreciation = ((zestimate - price) / price * 100).where(has_price & present(zestimate))
+            
+            # Clean up and standardize property type display
+            cleaned_type = props['property_type'].str.strip().str.upper().where(lambda t: t.ne(''))
+            property_type = cleaned_type.map(_TYPE_MAP).fillna(cleaned_type.str.title()).fillna('Unknown')
+            
+            formatted_address = format_addresses(props)
+            location_link = (
+                '<a href="https://www.google.com/maps/search/?api=1&query=' +
+                formatted_address.str.replace(' ', '+') +
+                '" target="_blank" class="map-link">🗺️ View</a>'
+            ).where(formatted_address.ne('Address Not Available'), 'N/A')
+            
+            df = pd.DataFrame({
+                'Address': formatted_address,
+                'City': props['city'].fillna('N/A'),
+                'State': props['state'].fillna('N/A'),
+                'ZIP': _address_part(props['zipcode'], *MISSING_ZIPCODE_TEXT).replace('', 'N/A'),
+                'Price': format_column(price, "${:,.0f}"),
+                'Fair Price': format_column(fair_price, "${:,.0f}"),
+                'Price Diff': (
+                    format_column(price_diff, "${:+,.0f}") + ' (' + format_column(price_diff_pct, "{:+.1f}%") + ')'
+                ).where(price_diff.notna(), 'N/A'),
+                'Type': property_type,
+                'Beds/Baths': (
+                    props['bedrooms'].fillna(0).astype(str) + '/' + props['bathrooms'].fillna(0).astype(str)
+                ),
+                'Sqft': format_column(props['living_area'], "{:,.0f}"),
+                'Year Built': format_column(props['year_built'], "{:.0f}"),
+                'Cap Rate': format_column(cap_rate, "{:.1f}%"),
+                'Monthly Rent': format_column(rent, "${:,.0f}"),
+                'HOA': format_column(props['monthly_hoa'], "${:,.0f}"),
+                'Appreciation': format_column(appreciation, "{:.1f}%"),
+                'Investment Score': format_column(props['investment_score'], "{:.1f}"),
+                'Location': location_link
+            })
             
             # Add CSS class for styling
             return df.style.set_properties(**{
@@ -189,130 +213,128 @@ def server(input, output, session):
             })
             
         except Exception as e:
-            print(f"Error in opportunities_table: {str(e)}")
-            return pd.DataFrame(columns=[
-                'Address', 'City', 'State', 'ZIP', 'Price', 'Fair Price', 'Price Diff', 'Type', 
-                'Beds/Baths', 'Sqft', 'Year Built', 'Cap Rate', 
-                'Monthly Rent', 'HOA', 'Appreciation', 'Investment Score', 'Location'
-            ])
+            log.error("Error in opportunities_table: %s", e)
+            return pd.DataFrame(columns=OPPORTUNITY_COLUMNS)
 
     @output
     @render.ui
     def heatmap():
-        # Force reactivity on refresh button
-        input.refresh_dashboard()
-        
         try:
             # Get current filters and location from sidebar
             location = input.location() if input.location() and input.location().strip() else "93720"
             metric = input.heatmap_metric()
             
-            # Get the number of results from the sidebar input
-            result_limit = input.top_n() if input.top_n() else 50
-            
-            print(f"Current location: {location}")  # Debug print
-            print(f"Current metric: {metric}")  # Debug print
-            print(f"Result limit: {result_limit}")  # Debug print
-            
-            filters = {
-                'price_min': input.price_min() or 100000,
-                'price_max': input.price_max() or 2000000,
-                'property_types': input.property_types() or None,
-                'sqft_min': input.sqft_min() or 500,
-                'sqft_max': input.sqft_max() or 5000,
-                'location': location,
-                'max_hoa': None
-            }
+            log.debug("Current location: %s, metric: %s", location, metric)
             
-            # Pass the limit from the sidebar input
-            properties = property_service.get_investment_opportunities('score', result_limit, filters)
-            print(f"Found {len(properties)} properties")  # Debug print
+            # The top properties the sidebar asks for, without those that have no coordinates
+            properties = current_properties().head(_map_limit())
+            properties = properties[present(properties['latitude']) & present(properties['longitude'])]
+            log.debug("Found %d properties", len(properties))
             
             # Always use sidebar location as center
             center_location = location
             
-            # Prepare data points
-            data_points = []
-            for p in properties:
-                if p.latitude and p.longitude:
-                    # Get intensity based on selected metric
-                    intensity = {
-                        'price': float(p.price) if p.price else 0,
-                        'fair_price': float(p.fair_price) if p.fair_price else 0,
-                        'price_diff': float(p.fair_price - p.price) if p.fair_price and p.price else 0,
-                        'sqft': float(p.living_area) if p.living_area else 0,
-                        'score': float(calculate_investment_score(p)),
-                        'roi': float((p.zestimate - p.price) / p.price) if p.price and p.zestimate else 0
-                    }.get(metric, float(p.price) if p.price else 0)
-                    
-                    # Calculate price difference and percentage
-                    price_diff = p.fair_price - p.price if p.fair_price and p.price else None
-                    price_diff_pct = (price_diff / p.price * 100) if price_diff is not None and p.price else None
-                    
-                    property_data = {
-                        'address': f"{p.address}, {p.city}",
-                        'price': p.price,
-                        'fair_price': p.fair_price,
-                        'price_diff': f"${price_diff:+,.0f}" if price_diff is not None else "N/A",
-                        'price_diff_pct': f"{price_diff_pct:+.1f}%" if price_diff_pct is not None else "N/A",
-                        'type': p.property_type or 'Unknown',
-                        'sqft': p.living_area,
-                        'beds': p.bedrooms,
-                        'baths': p.bathrooms,
-                        'year_built': p.year_built,
-                        'rent': p.rent_estimate,
-                        'cap_rate': (p.rent_estimate * 12 / p.price * 100) if p.price and p.rent_estimate else 0,
-                        'score': calculate_investment_score(p)
-                    }
-                    
-                    data_points.append([float(p.latitude), float(p.longitude), intensity, property_data])
+            # Metric columns, missing values as 0
+            price = properties['price'].fillna(0)
+            fair_price = properties['fair_price'].fillna(0)
+            zestimate = properties['zestimate'].fillna(0)
+            rent = properties['rent_estimate'].fillna(0)
+            score = properties['investment_score'].fillna(0)
+            has_price = present(price)
+            
+            # Get intensity based on selected metric
+            intensity = {
+                'price': price,
+                'fair_price': fair_price,
+                'price_diff': (fair_price - price).where(has_price & present(fair_price), 0),
+                'sqft': properties['living_area'].fillna(0),
+                'score': score,
+                'roi': ((zestimate - price) / price).where(has_price & present(zestimate), 0)
+            }.get(metric, price)
+            
+            # Calculate price difference and percentage
+            price_diff = (fair_price - price).where(has_price & present(fair_price))
+            price_diff_pct = price_diff / price * 100
+            
+            # Popup details (missing values as None, like Property fields)
+            details = properties[['price', 'fair_price', 'living_area', 'bedrooms', 'bathrooms', 'year_built', 'rent_estimate']]
+            details = details.astype(object).where(details.notna(), None).rename(columns={
+                'living_area': 'sqft', 'bedrooms': 'beds', 'bathrooms': 'baths', 'rent_estimate': 'rent'
+            })
+            details.insert(0, 'address', properties['address'].astype(str) + ', ' + properties['city'].astype(str))
+            details['price_diff'] = format_column(price_diff, "${:+,.0f}")
+            details['price_diff_pct'] = format_column(price_diff_pct, "{:+.1f}%")
+            details['type'] = properties['property_type'].fillna('Unknown')
+            details['cap_rate'] = cap_rates(rent.to_numpy(np.float64), price.to_numpy(np.float64))
+            details['score'] = score
+            
+            points = np.column_stack([
+                properties['latitude'], properties['longitude'], intensity, score
+            ]).astype(np.float32)
+            heatmap_details.clear()
+            heatmap_details.update(details.to_dict('list'))
             
             # Update the top_n input with actual number of results
-            ui.update_numeric("top_n", value=len(data_points))
+            ui.update_numeric("top_n", value=len(points))
             
-            print(f"Created {len(data_points)} data points")  # Debug print
+            log.debug("Created %d data points", len(points))
             
             # Create and return the heatmap
-            return ui.HTML(MainPanel.create_heatmap(center_location, data_points, metric))
+            return ui.HTML(render_heatmap(center_location, metric, points.tobytes(), heatmap_details_url, map_zoom()))
             
         except Exception as e:
-            print(f"Error rendering heatmap: {str(e)}")
-            import traceback
-            traceback.print_exc()  # Print full stack trace
+            log.exception("Error rendering heatmap: %s", e)
             return ui.div(f"Error rendering heatmap: {str(e)}")
 
-    # Add input validation handlers
+    # Add input validation handlers, debounced so typing doesn't trigger a round-trip per keystroke
+    validation_due = reactive.Value(None)
+
     @reactive.Effect
-    def _validate_price():
-        try:
-            price_min = input.price_min() or 100000
-            price_max = input.price_max() or 2000000
-            
-            if price_min < 0:
-                ui.update_numeric("price_min", value=0)
-            
-            if price_max <= price_min:
-                ui.update_numeric("price_max", value=max(price_min + 50000, 100000))
-        except Exception as e:
-            print(f"Error in price validation: {str(e)}")
+    @reactive.event(input.price_min, input.price_max, input.sqft_min, input.sqft_max, ignore_init=True)
+    def _schedule_validation():
+        validation_due.set(time.monotonic() + VALIDATION_DELAY)
 
     @reactive.Effect
-    def _validate_sqft():
+    def _validate_ranges():
+        due = validation_due()
+        if due is None:
+            return
+        remaining = due - time.monotonic()
+        if remaining > 0:
+            reactive.invalidate_later(remaining)
+            return
+        validation_due.set(None)
+        
         try:
-            sqft_min = input.sqft_min() or 500
-            sqft_max = input.sqft_max() or 5000
+            with reactive.isolate():
+                price_min = input.price_min() or 100000
+                price_max = input.price_max() or 2000000
+                sqft_min = input.sqft_min() or 500
+                sqft_max = input.sqft_max() or 5000
+                current = {name: input[name]() for name in ("price_min", "price_max", "sqft_min", "sqft_max")}
             
+            updates = {}
+            if price_min < 0:
+                updates["price_min"] = 0
+            if price_max <= price_min:
+                updates["price_max"] = max(price_min + 50000, 100000)
             if sqft_min < 0:
-                ui.update_numeric("sqft_min", value=0)
-            
+                updates["sqft_min"] = 0
             if sqft_max <= sqft_min:
-                ui.update_numeric("sqft_max", value=max(sqft_min + 100, 500))
+                updates["sqft_max"] = max(sqft_min + 100, 500)
+            
+            # Only send values that actually change, so updates don't re-trigger validation
+            for name, value in updates.items():
+                if current[name] != value:
+                    ui.update_numeric(name, value=value)
         except Exception as e:
-            print(f"Error in sqft validation: {str(e)}")
+            log.error("Error in range validation: %s", e)
 
 app = App(app_ui, server, static_assets=Path(__file__).parent / "www")
 
 if __name__ == "__main__":
-    print("Starting server on 0.0.0.0:8000...")
-    create_db("lotwize_case.csv")
+    logging.basicConfig(level=logging.WARNING)
+    # The app's own startup messages are shown; other modules stay at WARNING
+    log.setLevel(logging.INFO)
+    log.info("Starting server on 0.0.0.0:8000...")
     app.run(host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -1,83 +1,141 @@
-import pandas as pd
+import polars as pl
 import sqlite3
 from pathlib import Path
 import os
+from scoring_kernel import frame_investment_scores
+from models.property import PROPERTY_TYPE_MAP, DB_PROPERTY_TYPES
+from db_schema import PROPERTY_INDEXES, MISSING_ZIPCODE
 
-def calculate_fair_price(row):
-    """Calculate fair price based on property attributes"""
+def sqlite_type(dtype):
+    """SQLite column type for a Polars dtype, matching what pandas' to_sql used to create"""
+    if dtype == pl.Boolean or dtype.is_integer():
+        return "INTEGER"
+    if dtype.is_float():
+        return "REAL"
+    return "TEXT"
+
+def csv_signature(csv_file):
+    """Size and modification time of a CSV, recorded with the data built from it"""
+    stat = Path(csv_file).stat()
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+def built_from(db_path):
+    """CSV signature the database was last built from, None if it has not been built"""
+    if not Path(db_path).exists():
+        return None
+    conn = sqlite3.connect(db_path)
     try:
-        # Base price from actual price
-        base_price = row['price']
-        
-        # Adjust based on market factors
-        if pd.notna(row['zestimate']):
-            return (base_price + row['zestimate']) / 2
-        
-        return base_price
-        
-    except Exception as e:
-        print(f"Error calculating fair price: {str(e)}")
-        return row['price']  # Fallback to actual price
+        row = conn.execute("SELECT value FROM db_metadata WHERE key = 'source_csv'").fetchone()
+        return row[0] if row else None
+    except sqlite3.OperationalError:
+        # Built before the metadata table existed, or not built at all
+        return None
+    finally:
+        conn.close()
 
-def create_db(csv_file):
+def write_properties_table(conn, properties_df, source=None):
+    """Replace the properties table with one bulk insert inside a single transaction,
+    recording the signature of the CSV it came from"""
+    # The table is rebuilt from the CSV on failure, so durability is not needed during the load;
+    # the journal mode is left alone, since the app's connections may hold the database in WAL mode
+    conn.execute("PRAGMA synchronous=OFF")
+    
+    columns = ",\n".join(f'"{name}" {sqlite_type(dtype)}' for name, dtype in properties_df.schema.items())
+    create_sql = f'CREATE TABLE "properties" (\n{columns}\n)'
+    insert_sql = f"INSERT INTO properties VALUES ({','.join('?' * properties_df.width)})"
+    rows = properties_df.iter_rows()
+    
+    conn.execute("BEGIN")
+    try:
+        conn.execute("DROP TABLE IF EXISTS properties")
+        conn.execute(create_sql)
+        conn.executemany(insert_sql, rows)
+        for statement in PROPERTY_INDEXES:
+            conn.execute(statement)
+        # Written in the same transaction, so a recorded source always has a complete table behind it
+        conn.execute("CREATE TABLE IF NOT EXISTS db_metadata (key TEXT PRIMARY KEY, value TEXT)")
+        conn.execute("INSERT OR REPLACE INTO db_metadata VALUES ('source_csv', ?)", (source,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+def create_db(csv_file, force=False):
     """Create and initialize the database with property data"""
     try:
+        # Skip the rebuild when the database was built from this exact CSV; the app writes to the
+        # database itself, so its file mtime says nothing about the data
+        db_path = Path('real_estate.db')
+        if not force and not Path(csv_file).exists() and db_path.exists():
+            print(f"{csv_file} not found, using the existing database")
+            return
+        source = csv_signature(csv_file)
+        if not force and built_from(db_path) == source:
+            print(f"Database is up to date with {csv_file}, skipping rebuild")
+            return
+        
         print(f"Reading CSV file: {csv_file}")
-        properties_df = pd.read_csv(csv_file)
+        properties_df = pl.read_csv(csv_file, infer_schema_length=None)
+        
+        # Columns with no values at all are numeric, as pandas read them
+        properties_df = properties_df.with_columns(
+            pl.col(name).cast(pl.Float64) for name, series in properties_df.to_dict().items()
+            if series.dtype == pl.String and series.null_count() == properties_df.height
+        )
         
         # Add property_id if it doesn't exist
         if 'property_id' not in properties_df.columns:
-            properties_df['property_id'] = range(1, len(properties_df) + 1)
+            properties_df = properties_df.with_columns(pl.int_range(1, pl.len() + 1).alias('property_id'))
         
-        # Standardize property types
-        property_type_mapping = {
-            'SINGLE FAMILY': 'SINGLE FAMILY',
-            'SINGLE-FAMILY': 'SINGLE FAMILY',
-            'SINGLEFAMILY': 'SINGLE FAMILY',
-            'CONDO': 'CONDO',
-            'CONDOMINIUM': 'CONDO',
-            'TOWNHOUSE': 'TOWNHOUSE',
-            'TOWN_HOUSE': 'TOWNHOUSE',
-            'TOWNHOME': 'TOWNHOUSE'
-        }
+        # One row per property, so queries need no DISTINCT
+        properties_df = properties_df.unique(subset='property_id', keep='first', maintain_order=True)
         
-        # Convert property types to standard format
-        properties_df['propertyTypeDimension'] = properties_df['propertyTypeDimension'].str.upper()
-        properties_df['propertyTypeDimension'] = properties_df['propertyTypeDimension'].map(
-            property_type_mapping).fillna('SINGLE FAMILY')  # Default to SINGLE FAMILY if unknown
+        # Convert property types to standard format, defaulting to SINGLE FAMILY if unknown
+        db_type_map = {variant: standard for variant, standard in PROPERTY_TYPE_MAP.items() if standard in DB_PROPERTY_TYPES}
+        properties_df = properties_df.with_columns(
+            # Standardized property type
+            pl.col('propertyTypeDimension').str.strip_chars().str.to_uppercase()
+                .replace_strict(db_type_map, default='SINGLE FAMILY').fill_null('SINGLE FAMILY'),
+            # Fair price: average of price and zestimate when available, otherwise the price
+            pl.when(pl.col('zestimate').is_not_null())
+                .then((pl.col('price') + pl.col('zestimate')) / 2)
+                .otherwise(pl.col('price')).cast(pl.Float64).alias('fair_price')
+        )
         
-        # Calculate fair prices
-        properties_df['fair_price'] = properties_df.apply(calculate_fair_price, axis=1)
+        # Precompute the 0-10 investment score so queries can sort on an indexed column
+        properties_df = properties_df.with_columns(
+            pl.Series('investment_score', frame_investment_scores(properties_df))
+        )
         
         # Ensure address fields are not null
-        properties_df['streetAddress'] = properties_df['streetAddress'].fillna('Address Not Available')
-        properties_df['city'] = properties_df['city'].fillna('City Not Available')
-        properties_df['state'] = properties_df['state'].fillna('NA')
-        properties_df['zipcode'] = properties_df['zipcode'].fillna('00000')
+        properties_df = properties_df.with_columns(
+            pl.col('streetAddress').fill_null('Address Not Available'),
+            pl.col('city').fill_null('City Not Available'),
+            pl.col('state').fill_null('NA'),
+            # A numeric ZIP column stores the placeholder as 0, as SQLite would convert '00000'
+            pl.col('zipcode').fill_null(
+                pl.lit(MISSING_ZIPCODE) if properties_df['zipcode'].dtype == pl.String else int(MISSING_ZIPCODE)
+            )
+        )
         
         # Save predictions to CSV
         predictions_dir = Path('data')
         predictions_dir.mkdir(exist_ok=True)
         
-        predictions_df = pd.DataFrame({
-            'property_id': properties_df['property_id'],
-            'fair_price': properties_df['fair_price']
-        })
-        
         predictions_path = predictions_dir / 'predictions.csv'
-        predictions_df.to_csv(predictions_path, index=False)
+        properties_df.select('property_id', 'fair_price').write_csv(predictions_path)
         print(f"Saved predictions to {predictions_path}")
         
         # Create database
         print("Creating database...")
-        conn = sqlite3.connect('real_estate.db')
-        properties_df.to_sql('properties', conn, if_exists='replace', index=False)
+        conn = sqlite3.connect(db_path)
+        write_properties_table(conn, properties_df, source)
         conn.close()
         print("Database created successfully")
         
         # Print sample of data
         print("\nSample of processed data:")
-        print(properties_df[['property_id', 'price', 'fair_price', 'propertyTypeDimension']].head())
+        print(properties_df.select('property_id', 'price', 'fair_price', 'propertyTypeDimension').head())
         
     except Exception as e:
         print(f"Error creating database: {str(e)}")
@@ -86,4 +144,4 @@ def create_db(csv_file):
 if __name__ == "__main__":
     base_dir = Path(__file__).parent
     csv_path = base_dir / "lotwize_case.csv"
-    create_db(str(csv_path))
\ No newline at end of file
+    create_db(str(csv_path), force=True)
\ No newline at end of file
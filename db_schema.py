@@ -0,0 +1,46 @@
+# SQL shared by the database build in create_db and the services that query it
+from datetime import date
+
+# Year that property ages are measured from, fixed for the life of the process
+CURRENT_YEAR = date.today().year
+
+# Placeholder create_db stores for a missing ZIP code; a numeric zipcode column holds it as 0
+MISSING_ZIPCODE = '00000'
+# The placeholder as text, read from a text or a numeric zipcode column
+MISSING_ZIPCODE_TEXT = (MISSING_ZIPCODE, str(int(MISSING_ZIPCODE)))
+
+# ScoringService.score_property's total_score as a SQL expression over the properties table, so
+# queries can sort on it; keep in sync with ScoringService's calculate_* methods and weights
+TOTAL_SCORE_SQL = """(
+    0.35 * (CASE WHEN COALESCE(rentZestimate, 0) != 0 AND COALESCE(price, 0) != 0
+        THEN MIN(10, (rentZestimate * 12 - rentZestimate * 12 * 0.4) / price * 100) ELSE 0 END)
+    + 0.25 * 7
+    + 0.15 * (CASE
+        WHEN COALESCE(yearBuilt, 0) = 0 THEN 5
+        WHEN COALESCE(zestimate, 0) != 0 AND COALESCE(price, 0) != 0
+        THEN (MAX(0, 10 - ({year} - yearBuilt) / 10.0) + 10 * MIN(1.2, MAX(0.8, zestimate * 1.0 / price))) / 2
+        ELSE MAX(0, 10 - ({year} - yearBuilt) / 10.0) END)
+    + 0.15 * 6
+    + 0.10 * (CASE WHEN COALESCE(zestimate, 0) != 0 AND COALESCE(price, 0) != 0
+        THEN (10 - ABS(zestimate - price) * 1.0 / price * 100 + {vacancy} + 6) / 3.0
+        ELSE ({vacancy} + 6) / 2.0 END)
+) * 10""".format(year=CURRENT_YEAR, vacancy="""(CASE propertyTypeDimension
+        WHEN 'Single Family' THEN 8 WHEN 'Multi Family' THEN 7 WHEN 'Apartment' THEN 6
+        WHEN 'Retail' THEN 5 WHEN 'Office' THEN 4 WHEN 'Industrial' THEN 6 WHEN 'Land' THEN 3
+        ELSE 5 END)""")
+
+# Every index on the properties table; PropertyService also runs these to migrate older databases
+PROPERTY_INDEXES = (
+    # Composite so the fair-price range filter is checked from the index during price scans
+    "CREATE INDEX IF NOT EXISTS ix_props_price ON properties(price, fair_price)",
+    "CREATE INDEX IF NOT EXISTS ix_props_zip ON properties(zipcode)",
+    # Unique, so the property queries can skip DISTINCT
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_props_id ON properties(property_id)",
+    "CREATE INDEX IF NOT EXISTS ix_type_price ON properties(UPPER(propertyTypeDimension), price)",
+    # These match the ORDER BY expressions in PropertyService.SORT_CLAUSES word for word,
+    # so a sorted page is an index walk that stops at the LIMIT instead of a full sort
+    "CREATE INDEX IF NOT EXISTS ix_score ON properties(investment_score DESC)",
+    "CREATE INDEX IF NOT EXISTS ix_roi_potential ON properties(COALESCE((zestimate - price) / NULLIF(price, 0), 0) DESC)",
+    "CREATE INDEX IF NOT EXISTS ix_cap_rate ON properties(COALESCE(rentZestimate * 12.0 / NULLIF(price, 0), 0) DESC)",
+    f"CREATE INDEX IF NOT EXISTS ix_total_score ON properties({TOTAL_SCORE_SQL} DESC)"
+)
@@ -2,7 +2,25 @@ from dataclasses import dataclass
 from typing import Optional, List
 from datetime import datetime
 
-@dataclass
+# Spelling variants of property types mapped to the standard (upper case) names
+PROPERTY_TYPE_MAP = {
+    'SINGLE FAMILY': 'SINGLE FAMILY',
+    'SINGLE-FAMILY': 'SINGLE FAMILY',
+    'SINGLEFAMILY': 'SINGLE FAMILY',
+    'CONDO': 'CONDO',
+    'CONDOMINIUM': 'CONDO',
+    'TOWNHOUSE': 'TOWNHOUSE',
+    'TOWN_HOUSE': 'TOWNHOUSE',
+    'TOWNHOME': 'TOWNHOUSE',
+    'MULTI-FAMILY': 'MULTI-FAMILY',
+    'MULTI FAMILY': 'MULTI-FAMILY',
+    'LAND': 'LAND'
+}
+
+# Property types stored in the database; anything else is loaded as SINGLE FAMILY
+DB_PROPERTY_TYPES = ['SINGLE FAMILY', 'CONDO', 'TOWNHOUSE']
+
+@dataclass(slots=True, frozen=True)
 class Property:
     property_id: int
     price: float
@@ -25,6 +43,8 @@ class Property:
     state: str
     zipcode: str
     county: Optional[str]
+    investment_score: Optional[float] = None
+    total_score: Optional[float] = None
     
     @property
     def cap_rate(self) -> Optional[float]:
@@ -39,7 +59,7 @@ class Property:
             return self.price / self.living_area
         return None
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class InvestmentScore:
     property: Property
     total_score: float
@@ -1,4 +1,6 @@
+import joblib
 import pandas as pd
+from pathlib import Path
 from sklearn.preprocessing import StandardScaler, OneHotEncoder
 from sklearn.decomposition import PCA
 from sklearn.compose import ColumnTransformer
@@ -6,17 +8,24 @@ from sklearn.pipeline import Pipeline
 
 
 class PCA_Manager:
-    def __init__(self):
-        pass
+    def __init__(self, cache_path=None):
+        # Fitted pipeline is reused for later calls with the same feature lists
+        self.cache_path = Path(cache_path) if cache_path else None
+        self.features = None
+        self.pipeline = None
+        if self.cache_path and self.cache_path.exists():
+            # Memory-map the fitted arrays (cache is written uncompressed) so workers share their pages
+            self.features, self.pipeline = joblib.load(self.cache_path, mmap_mode='r')
 
     def convert_x_to_pca(self, x, numeric_features, categorical_features): #90 components exactly
         X = x
         X[numeric_features] = X[numeric_features].fillna(X[numeric_features].mean())
+        X[categorical_features] = X[categorical_features].fillna('Unknown').astype(str)
+
+        features = (tuple(numeric_features), tuple(categorical_features))
+        if self.pipeline is not None and self.features == features:
+            return self.pipeline.transform(X)
 
-        for cat_feature in categorical_features:
-            X[cat_feature] = X[cat_feature].fillna('Unknown')
-            X[cat_feature] = X[cat_feature].astype(str)
-        
         preprocessor = ColumnTransformer(
             transformers=[
                 ('num', Pipeline([
@@ -29,9 +38,15 @@ class PCA_Manager:
             remainder='drop'
         )
 
+        # Randomized SVD only computes the 90 components we keep
         pca_pipeline = Pipeline([
             ('preprocessor', preprocessor),
-            ('pca', PCA(n_components=90))
+            ('pca', PCA(n_components=90, svd_solver='randomized', random_state=0))
             ])
 
-        return pca_pipeline.fit_transform(X)
\ No newline at end of file
+        X_pca = pca_pipeline.fit_transform(X)
+        self.features, self.pipeline = features, pca_pipeline
+        if self.cache_path:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            joblib.dump((features, pca_pipeline), self.cache_path)
+        return X_pca
@@ -0,0 +1,178 @@
+import numpy as np
+
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+
+def _score_numpy(price, rent, zest, yr, hoa):
+    """NumPy implementation of the 0-10 investment score over column arrays"""
+    valid_price = price > 0
+
+    # Cap rate score (0-4 points)
+    cap = np.divide(rent * 12, price, out=np.zeros_like(price), where=valid_price & (rent == rent))
+    score = np.clip(cap * 40, 0, 4)
+
+    # Appreciation potential (0-3 points)
+    app = np.divide(zest - price, price, out=np.zeros_like(price), where=valid_price & (zest == zest))
+    score += np.clip(app * 10, 0, 3)
+
+    # Property age (0-2 points), 0 when year built is unknown
+    age = np.clip((2023 - yr) / 100, 0, 1)
+    score += np.where((yr == yr) & (yr != 0), 2 * (1 - age), 0)
+
+    # HOA consideration (0-1 point)
+    score += np.where((hoa == hoa) & (hoa >= 200), 0, 1)
+
+    return score
+
+
+if NUMBA_AVAILABLE:
+    # No fastmath: the kernel relies on NaN checks for missing values
+    @njit(cache=True, parallel=True)
+    def score_kernel(price, rent, zest, yr, hoa, out):
+        """Same math as _score_numpy, fused into one parallel loop"""
+        for i in prange(price.size):
+            p = price[i]
+            s = 0.0
+            if p > 0:
+                r = rent[i]
+                if r == r:
+                    s += min(max(r * 12 / p * 40, 0.0), 4.0)
+                z = zest[i]
+                if z == z:
+                    s += min(max((z - p) / p * 10, 0.0), 3.0)
+            y = yr[i]
+            if y == y and y != 0:
+                s += 2 * (1 - min(max((2023 - y) / 100, 0.0), 1.0))
+            h = hoa[i]
+            if not (h == h and h >= 200):
+                s += 1.0
+            out[i] = s
+
+    @njit(cache=True, parallel=True)
+    def finalize_kernel(pred, noise, price, out):
+        """Same math as _finalize_numpy, fused into one parallel loop"""
+        for i in prange(pred.size):
+            v = max(pred[i], 0.0) * (1.0 + 0.05 * noise[i])
+            lo = price[i] * 0.5
+            hi = price[i] * 1.5
+            out[i] = lo if v < lo else (hi if v > hi else v)
+
+    @njit(cache=True, parallel=True)
+    def subscore_kernel(price, rent, zest, yr, vacancy, location, market, year, roi, cond, risk, total):
+        """Same math as _subscores_numpy, fused into one parallel loop"""
+        for i in prange(price.size):
+            p = price[i]
+            r = rent[i]
+            z = zest[i]
+            y = yr[i]
+            # Missing (NaN) and zero both count as absent
+            has_price = p == p and p != 0
+            has_value = has_price and z == z and z != 0
+            
+            roi_i = 0.0
+            if has_price and r == r and r != 0:
+                annual_rent = r * 12
+                roi_i = min(10.0, (annual_rent - annual_rent * 0.4) / p * 100)
+            
+            cond_i = 5.0
+            if y == y and y != 0:
+                cond_i = max(0.0, 10 - (year - y) / 10)
+                if has_value:
+                    cond_i = (cond_i + 10 * min(1.2, max(0.8, z / p))) / 2
+            
+            if has_value:
+                risk_i = (10 - abs(z - p) / p * 100 + vacancy[i] + 6) / 3
+            else:
+                risk_i = (vacancy[i] + 6) / 2
+            
+            roi[i] = roi_i
+            cond[i] = cond_i
+            risk[i] = risk_i
+            total[i] = (roi_i * 0.35 + location * 0.25 + cond_i * 0.15 + market * 0.15 + risk_i * 0.10) * 10
+
+    # Compile (or load from cache) at import so the first request doesn't pay for it
+    _warm = np.ones(1)
+    score_kernel(_warm, _warm, _warm, _warm, _warm, np.empty(1))
+    finalize_kernel(_warm, _warm, _warm, np.empty(1))
+    subscore_kernel(_warm, _warm, _warm, _warm, _warm, 7.0, 6.0, 2024.0, np.empty(1), np.empty(1), np.empty(1), np.empty(1))
+
+
+def investment_scores(price, rent, zest, yr, hoa) -> np.ndarray:
+    """0-10 investment scores for float64 column arrays (NaN marks missing values)"""
+    if NUMBA_AVAILABLE:
+        out = np.empty_like(price)
+        score_kernel(price, rent, zest, yr, hoa, out)
+        return out
+    return _score_numpy(price, rent, zest, yr, hoa)
+
+
+def _finalize_numpy(pred, noise, price):
+    """NumPy implementation of the fair price post-processing"""
+    # No negative prices, 5% multiplicative noise, then bound to 50-150% of the listed price
+    jittered = np.maximum(pred, 0) * (1 + 0.05 * noise)
+    return np.clip(jittered, price * 0.5, price * 1.5)
+
+
+def finalize_predictions(pred, noise, price) -> np.ndarray:
+    """Fair price predictions from raw model output, standard normal noise and listed prices (float64 arrays)"""
+    if NUMBA_AVAILABLE:
+        out = np.empty_like(pred)
+        finalize_kernel(pred, noise, price, out)
+        return out
+    return _finalize_numpy(pred, noise, price)
+
+
+def cap_rates(rent, price) -> np.ndarray:
+    """Gross cap rates in percent for float64 column arrays, 0 where rent or price is missing"""
+    out = np.zeros_like(price)
+    np.divide(rent * 12 * 100, price, out=out, where=(price > 0) & (rent == rent))
+    return out
+
+
+def _subscores_numpy(price, rent, zest, yr, vacancy, location, market, year):
+    """NumPy implementation of ScoringService's ROI, condition, risk and weighted total scores"""
+    # Missing (NaN) and zero both count as absent, like the scalar scoring methods
+    has_price = np.nan_to_num(price) != 0
+    has_value = has_price & (np.nan_to_num(zest) != 0)
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # ROI after 40% operating expenses, capped at 10
+        annual_rent = rent * 12
+        net_roi = (annual_rent - annual_rent * 0.4) / price * 100
+        roi = np.where(has_price & (np.nan_to_num(rent) != 0), np.minimum(10, net_roi), 0.0)
+        
+        # Age score, averaged with the zestimate/price condition factor when available
+        age_score = np.maximum(0, 10 - (year - yr) / 10)
+        value_score = 10 * np.clip(zest / price, 0.8, 1.2)
+        cond = np.where(
+            np.nan_to_num(yr) != 0, np.where(has_value, (age_score + value_score) / 2, age_score), 5.0
+        )
+        
+        # Mean of price volatility (when available), vacancy and market risk
+        price_risk = 10 - np.abs(zest - price) / price * 100
+        risk = np.where(has_value, (price_risk + vacancy + 6) / 3, (vacancy + 6) / 2)
+    
+    total = (roi * 0.35 + location * 0.25 + cond * 0.15 + market * 0.15 + risk * 0.10) * 10
+    return roi, cond, risk, total
+
+
+def property_subscores(price, rent, zest, yr, vacancy, location, market, year):
+    """ROI, condition, risk and 0-100 total scores for float64 column arrays (NaN marks missing values), ages measured from year"""
+    if NUMBA_AVAILABLE:
+        roi, cond, risk, total = (np.empty_like(price) for _ in range(4))
+        subscore_kernel(price, rent, zest, yr, vacancy, float(location), float(market), float(year), roi, cond, risk, total)
+        return roi, cond, risk, total
+    return _subscores_numpy(price, rent, zest, yr, vacancy, location, market, year)
+
+
+# Names of the score inputs in the properties table
+DB_SCORE_COLUMNS = ('price', 'rentZestimate', 'zestimate', 'yearBuilt', 'monthlyHoaFee')
+
+
+def frame_investment_scores(df, columns=DB_SCORE_COLUMNS) -> np.ndarray:
+    """investment_scores over the given DataFrame columns, in price/rent/zestimate/year/HOA order"""
+    return investment_scores(*(np.ascontiguousarray(df[name], dtype=np.float64) for name in columns))
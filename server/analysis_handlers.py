@@ -1,6 +1,8 @@
 from shiny import render
 import plotly.graph_objects as go
+from server.figures import figure_html
 import pandas as pd
+import numpy as np
 
 def register_analysis_handlers(input, output, session, property_service, scoring_service):
     @output
@@ -16,25 +18,30 @@ def register_analysis_handlers(input, output, session, property_service, scoring
         properties = property_service.search_properties(filters)
         scores = scoring_service.score_properties(properties)
         
-        # Create ROI analysis plot
+        prices = pd.Series([p.property.price for p in scores], dtype='float64')
+        roi_scores = pd.Series([p.roi_score for p in scores], dtype='float64')
+        living_areas = np.array([p.property.living_area for p in scores], dtype='float64')
+        addresses = pd.Series([p.property.address for p in scores], dtype=object).fillna('').str[:30]
+        
+        # Create ROI analysis plot (WebGL, so large result sets stay responsive)
         fig = go.Figure()
         
-        fig.add_trace(go.Scatter(
-            x=[p.property.price for p in scores],
-            y=[p.roi_score for p in scores],
+        fig.add_trace(go.Scattergl(
+            x=prices,
+            y=roi_scores,
             mode='markers',
             marker=dict(
-                size=[p.property.living_area/100 for p in scores],
+                # Bounded marker sizes so outliers don't cover the plot
+                size=np.clip(np.nan_to_num(living_areas / 100), 4, 40),
                 color=[p.total_score for p in scores],
                 colorscale='Viridis',
                 showscale=True
             ),
-            text=[
-                f"Address: {p.property.address}<br>"
-                f"Price: ${p.property.price:,.0f}<br>"
-                f"ROI Score: {p.roi_score:.1f}"
-                for p in scores
-            ],
+            text=(
+                "Address: " + addresses + "<br>"
+                + "Price: " + prices.map("${:,.0f}".format) + "<br>"
+                + "ROI Score: " + roi_scores.map("{:.1f}".format)
+            ),
             hovertemplate="%{text}<extra></extra>"
         ))
         
@@ -45,7 +52,7 @@ def register_analysis_handlers(input, output, session, property_service, scoring
             showlegend=False
         )
         
-        return fig.to_html(include_plotlyjs="cdn")
+        return figure_html(fig)
 
     @output
     @render.ui
@@ -58,14 +65,16 @@ def register_analysis_handlers(input, output, session, property_service, scoring
         }
         
         properties = property_service.search_properties(filters)
-        scores = scoring_service.score_properties(properties)
+        top_scores = scoring_service.score_properties(properties, top_k=5)  # Show top 5 properties
         
         # Create risk assessment radar chart
         categories = ['Price Volatility', 'Vacancy', 'Market', 'Location', 'Property Condition']
         
         fig = go.Figure()
         
-        for score in scores[:5]:  # Show top 5 properties
+        names = pd.Series([score.property.address for score in top_scores], dtype=object).fillna('').str[:30] + "..."
+        
+        for score, name in zip(top_scores, names):
             fig.add_trace(go.Scatterpolar(
                 r=[
                     10 - score.risk_score,  # Invert risk score
@@ -76,7 +85,7 @@ def register_analysis_handlers(input, output, session, property_service, scoring
                 ],
                 theta=categories,
                 fill='toself',
-                name=f"{score.property.address[:30]}..."
+                name=name
             ))
             
         fig.update_layout(
@@ -90,4 +99,4 @@ def register_analysis_handlers(input, output, session, property_service, scoring
             title="Risk Assessment - Top Properties"
         )
         
-        return fig.to_html(include_plotlyjs="cdn") 
\ No newline at end of file
+        return figure_html(fig) 
\ No newline at end of file
@@ -0,0 +1,15 @@
+import uuid
+import plotly.io as pio
+
+# orjson serializes figure data several times faster than the stdlib json encoder
+pio.json.config.default_engine = 'orjson'
+
+def figure_html(fig) -> str:
+    """Render a figure as a div plus a Plotly.newPlot call (plotly.js is loaded in the page head)"""
+    div_id = f"plot-{uuid.uuid4().hex}"
+    # Escape "</" so text in the figure (e.g. addresses) can't close the script tag
+    fig_json = pio.to_json(fig, validate=False).replace("</", "<\\/")
+    return (
+        f'<div id="{div_id}"></div>'
+        f'<script>Plotly.newPlot("{div_id}", {fig_json});</script>'
+    )
@@ -0,0 +1,31 @@
+# Filter and column helpers shared by app.py and the server handlers
+
+# Row limit when the sidebar asks for the maximum number of results
+MAX_RESULTS = 2000
+
+def sidebar_filters(input) -> dict:
+    """Property filters from the sidebar inputs; empty boxes fall back to the defaults, and an
+    empty location applies no location filter"""
+    location = input.location()
+    return {
+        'price_min': input.price_min() or 100000,
+        'price_max': input.price_max() or 2000000,
+        'property_types': input.property_types() or None,
+        'sqft_min': input.sqft_min() or 500,
+        'sqft_max': input.sqft_max() or 5000,
+        'location': location if location and location.strip() else None,
+        'show_max_results': input.show_max_results(),
+        'max_hoa': None
+    }
+
+def result_limit(filters: dict, top_n) -> int:
+    """Number of results to fetch for the filters and the sidebar's top_n"""
+    return MAX_RESULTS if filters['show_max_results'] else top_n or 50
+
+def present(values):
+    """Mask of values that are neither missing nor zero"""
+    return values.notna() & values.ne(0)
+
+def as_text(values):
+    """Values as display text, with missing values shown as None"""
+    return values.astype(object).where(values.notna(), None).astype(str)
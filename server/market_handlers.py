@@ -1,13 +1,19 @@
-from shiny import render, ui
+from shiny import render, ui, reactive
 import plotly.graph_objects as go
+from server.figures import figure_html
 import pandas as pd
 
 def register_market_handlers(input, output, session, market_service):
+    @reactive.Calc
+    def market_bundle():
+        """Fetch all market data for the current location once for the three outputs"""
+        return market_service.get_all(input.location() or "National Average")
+
     @output
     @render.ui
     def market_trends():
         location = input.location() or "National Average"
-        trends = market_service.get_market_trends(location)
+        trends = market_bundle()['trends']
         
         # Create market trends plot
         fig = go.Figure()
@@ -46,13 +52,13 @@ def register_market_handlers(input, output, session, market_service):
             margin=dict(t=30, b=30)
         )
         
-        return ui.HTML(fig.to_html(include_plotlyjs="cdn"))
+        return ui.HTML(figure_html(fig))
 
     @output
     @render.ui
     def demographic_data():
         location = input.location() or "National Average"
-        demographics = market_service.get_demographic_data(location)
+        demographics = market_bundle()['demographics']
         
         # Create demographics visualization
         fig = go.Figure()
@@ -91,13 +97,13 @@ def register_market_handlers(input, output, session, market_service):
             margin=dict(t=30, b=30)
         )
         
-        return ui.HTML(fig.to_html(include_plotlyjs="cdn"))
+        return ui.HTML(figure_html(fig))
 
     @output
     @render.ui
     def economic_indicators():
         location = input.location() or "National Average"
-        indicators = market_service.get_economic_indicators(location)
+        indicators = market_bundle()['economics']
         
         # Create economic indicators visualization
         fig = go.Figure()
@@ -124,4 +130,4 @@ def register_market_handlers(input, output, session, market_service):
             margin=dict(t=30, b=30)
         )
         
-        return ui.HTML(fig.to_html(include_plotlyjs="cdn"))
+        return ui.HTML(figure_html(fig))
@@ -1,13 +1,31 @@
 from shiny import render, ui, reactive
 import plotly.graph_objects as go
+from server.figures import figure_html
+from server.helpers import sidebar_filters, result_limit, present, as_text
+from ui.main_panel import MainPanel
 import pandas as pd
 import numpy as np
+from starlette.responses import JSONResponse
+from scoring_kernel import cap_rates
+from db_schema import MISSING_ZIPCODE_TEXT
+import logging
+
+log = logging.getLogger(__name__)
+
+# Property fields the opportunities table shows, plus the ones score_properties reads
+_TABLE_FIELDS = (
+    'property_id', 'address', 'city', 'state', 'zipcode', 'property_type', 'bedrooms', 'bathrooms', 'living_area',
+    'price', 'fair_price', 'rent_estimate', 'zestimate', 'year_built', 'total_score'
+)
 
 def register_property_handlers(input, output, session, property_service, scoring_service, market_service):
     # Add reactive values to track refresh button clicks and map state
     refresh_trigger = reactive.Value(0)
     current_zoom = reactive.Value(11)  # Default zoom level
-    default_location = "94110"  # Match sidebar default
+    
+    # Property details for the map tooltips, one list per field
+    map_details = {}
+    map_details_url = session.dynamic_route("map_details", lambda request: JSONResponse(map_details))
     
     @reactive.Effect
     @reactive.event(input.refresh_dashboard)
@@ -19,82 +37,93 @@ def register_property_handlers(input, output, session, property_service, scoring
     def store_map_zoom(zoom_level):
         current_zoom.set(float(zoom_level))
 
-    def _get_current_filters():
-        """Helper function to get current filters consistently"""
-        return {
-            'price_min': input.price_min() or 100000,
-            'price_max': input.price_max() or 2000000,
-            'property_types': input.property_types(),
-            'sqft_min': input.sqft_min() or 500,
-            'sqft_max': input.sqft_max() or 5000,
-            'location': input.location() if input.location() and input.location().strip() else default_location,
-            'show_max_results': input.show_max_results()
-        }
+    @reactive.Calc
+    def _filters():
+        """Current filters, read from the inputs once per change and shared by all outputs"""
+        return sidebar_filters(input)
+
+    @reactive.Calc
+    def _result_limit():
+        """Number of results to fetch for the current filters"""
+        return result_limit(_filters(), input.top_n())
+
+    @reactive.Calc
+    def _props_and_scores():
+        """Score-sorted properties and their scores, computed once per filter set for the map and table"""
+        filters = _filters()
+        properties = property_service.get_investment_opportunities(
+            sort_by='score',
+            limit=_result_limit(),
+            filters=filters
+        )
+        return properties, scoring_service.score_properties(properties)
 
     @output
     @render.ui
     @reactive.event(input.refresh_dashboard, input.heatmap_metric)
     def map():
-        filters = _get_current_filters()
-        limit = 2000 if filters['show_max_results'] else input.top_n() or 50
-        
         try:
-            properties = property_service.get_investment_opportunities(
-                sort_by='score',
-                limit=limit,
-                filters=filters
-            )
-            scores = scoring_service.score_properties(properties)
+            properties, scores = _props_and_scores()
             
             if not properties:
                 fig = go.Figure().update_layout(
                     title="No properties found matching criteria",
                     height=400
                 )
-                return ui.HTML(fig.to_html(include_plotlyjs="cdn"))
+                return ui.HTML(figure_html(fig))
+            
+            # Numeric fields as one array per attribute, missing values as 0
+            n = len(properties)
+            arrs = {
+                name: np.fromiter((getattr(p, name) or 0 for p in properties), dtype=np.float64, count=n)
+                for name in ('latitude', 'longitude', 'price', 'living_area', 'rent_estimate', 'investment_score')
+            }
+            price = arrs['price']
+            cap_rate = cap_rates(arrs['rent_estimate'], price)
             
             # Get heatmap values based on selected metric
             heatmap_metric = input.heatmap_metric()
             if heatmap_metric == "price":
-                z_values = [p.price for p in properties]
-                hover_text = [f"${p.price:,.0f}" for p in properties]
+                z_values = price
                 colorbar_title = "Price ($)"
             elif heatmap_metric == "sqft":
-                z_values = [p.living_area for p in properties]
-                hover_text = [f"{p.living_area:,.0f} sqft" for p in properties]
+                z_values = arrs['living_area']
                 colorbar_title = "Square Footage"
             elif heatmap_metric == "score":
-                z_values = [s.total_score for s in scores]
-                hover_text = [f"Score: {s.total_score:.1f}" for s in scores]
+                z_values = np.fromiter((s.total_score for s in scores), dtype=np.float64, count=n)
                 colorbar_title = "Property Score"
             else:  # roi
-                z_values = [s.roi_score for s in scores]
-                hover_text = [f"ROI: {s.roi_score:.1f}%" for s in scores]
+                z_values = np.fromiter((s.roi_score for s in scores), dtype=np.float64, count=n)
                 colorbar_title = "ROI (%)"
             
-            data_points = []
-            for p, hover, z in zip(properties, hover_text, z_values):
-                property_data = {
-                    'address': f"{p.address}, {p.city}",
-                    'price': p.price,
-                    'fair_price': p.fair_price,  # Include fair price
-                    'type': p.property_type or 'Unknown',
-                    'sqft': p.living_area,
-                    'beds': p.bedrooms,
-                    'baths': p.bathrooms,
-                    'year_built': p.year_built,
-                    'rent': p.rent_estimate,
-                    'cap_rate': (p.rent_estimate * 12 / p.price * 100) if p.price and p.rent_estimate else 0,
-                    'score': calculate_investment_score(p)
-                }
-                data_points.append([float(p.latitude), float(p.longitude), z, property_data])
-            
-            return ui.HTML(MainPanel.create_heatmap(location, data_points, metric=heatmap_metric))
+            # Properties without coordinates can't be placed on the map
+            mapped = np.flatnonzero((arrs['latitude'] != 0) & (arrs['longitude'] != 0))
+            points = np.column_stack([
+                arrs['latitude'], arrs['longitude'], z_values, arrs['investment_score']
+            ])[mapped]
+            
+            # Marker details as one list per field, served to the browser on the first hover
+            shown = [properties[i] for i in mapped]
+            map_details.clear()
+            map_details.update({
+                'address': [f"{p.address}, {p.city}" for p in shown],
+                'price': price[mapped].tolist(),
+                'fair_price': [p.fair_price for p in shown],
+                'type': [p.property_type or 'Unknown' for p in shown],
+                'sqft': arrs['living_area'][mapped].tolist(),
+                'beds': [p.bedrooms for p in shown],
+                'baths': [p.bathrooms for p in shown],
+                'year_built': [p.year_built for p in shown],
+                'rent': arrs['rent_estimate'][mapped].tolist(),
+                'cap_rate': cap_rate[mapped].tolist(),
+                'score': [p.investment_score for p in shown]
+            })
+            location = _filters()['location']
+            
+            return ui.HTML(MainPanel.create_heatmap(location, points, heatmap_metric, map_details_url, current_zoom()))
             
         except Exception as e:
-            print(f"Error rendering heatmap: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            log.exception("Error rendering heatmap: %s", e)
             return ui.HTML("Error creating map")
 
     # Add handler for zoom level changes
@@ -109,92 +138,59 @@ def register_property_handlers(input, output, session, property_service, scoring
     @reactive.event(input.refresh_dashboard, input.sort_criteria)
     def opportunities_table():
         try:
-            filters = _get_current_filters()
-            limit = 2000 if filters['show_max_results'] else input.top_n() or 50
-            
-            properties = property_service.get_investment_opportunities(
-                sort_by=input.sort_criteria() or 'score',
-                limit=limit,
-                filters=filters
-            )
-            
-            # Debug print
-            print(f"Found {len(properties)} properties")
-            if properties:
-                print("Sample property prices:")
-                for p in properties[:3]:
-                    print(f"Price: ${p.price:,.0f}, Fair Price: ${p.fair_price:,.0f}")
-            
-            scores = scoring_service.score_properties(properties)
+            # Only properties priced within 50% of their fair price
+            sort_by = input.sort_criteria() or 'score'
+            if sort_by == 'score':
+                # The map's result, filtered here, so a refresh runs one query and one scoring pass
+                properties, scores = _props_and_scores()
+                near_fair = [
+                    i for i, p in enumerate(properties)
+                    if (p.price or 0) > 0 and p.fair_price is not None and abs(p.fair_price - p.price) <= p.price * 0.5
+                ]
+                properties, scores = [properties[i] for i in near_fair], [scores[i] for i in near_fair]
+            else:
+                # Other orders need their own query anyway, so the filter goes into it
+                properties = property_service.get_investment_opportunities(
+                    sort_by=sort_by,
+                    limit=_result_limit(),
+                    filters={**_filters(), 'max_price_diff_pct': 50},
+                    fields=_TABLE_FIELDS
+                )
+                scores = scoring_service.score_properties(properties)
             
             if not properties:
                 return pd.DataFrame()
             
-            # Pre-filter properties based on price difference percentage
-            filtered_properties_and_scores = []
-            for p, s in zip(properties, scores):
-                if not p.fair_price or not p.price:
-                    continue
-                    
-                price_diff = p.fair_price - p.price
-                price_diff_pct = (price_diff / p.price * 100)
-                
-                if abs(price_diff_pct) <= 50:
-                    filtered_properties_and_scores.append((p, s))
-                else:
-                    print(f"Filtering out property with {price_diff_pct:.1f}% price difference: {p.address}")
-            
-            # Create DataFrame for display
-            data = []
-            for p, s in filtered_properties_and_scores:
-                try:
-                    # Calculate price difference and percentage
-                    price_diff = p.fair_price - p.price
-                    price_diff_pct = (price_diff / p.price * 100)
-                    
-                    row_data = {
-                        'Address': p.address,
-                        'Price': f"${p.price:,.0f}" if p.price else 'N/A',
-                        'Fair Price': f"${p.fair_price:,.0f}" if p.fair_price else 'N/A',
-                        'Price Diff': f"${price_diff:+,.0f} ({price_diff_pct:+.1f}%)" if price_diff is not None else 'N/A',
-                        'City': p.city,
-                        'State': p.state,
-                        'ZIP': p.zipcode,
-                        'Type': p.property_type,
-                        'Beds/Baths': f"{p.bedrooms}/{p.bathrooms}",
-                        'Sqft': f"{p.living_area:,.0f}" if p.living_area else 'N/A',
-                        'Score': f"{s.total_score:.1f}",
-                        'ROI Score': f"{s.roi_score:.1f}"
-                    }
-                    data.append(row_data)
-                    
-                except Exception as row_error:
-                    print(f"Error processing row: {str(row_error)}")
-                    continue
-            
-            # Create DataFrame with explicit column order
-            columns = ['Address', 'Price', 'Fair Price', 'Price Diff', 'City', 'State', 'ZIP', 
-                      'Type', 'Beds/Baths', 'Sqft', 'Score', 'ROI Score']
-            
-            df = pd.DataFrame(data, columns=columns)
-            
-            # Debug print
-            print("DataFrame columns:", df.columns.tolist())
-            print("Sample of first row:", df.iloc[0] if not df.empty else "No data")
+            # Raw columns for every property and its score
+            df = pd.DataFrame.from_records(
+                [
+                    (p.address, p.city, p.state, p.zipcode, p.property_type, p.bedrooms, p.bathrooms,
+                     p.living_area, p.price, p.fair_price, s.total_score, s.roi_score)
+                    for p, s in zip(properties, scores)
+                ],
+                columns=['address', 'city', 'state', 'zipcode', 'property_type', 'bedrooms', 'bathrooms',
+                         'living_area', 'price', 'fair_price', 'total_score', 'roi_score']
+            )
             
-            return df
+            price_diff = df['fair_price'] - df['price']
+            price_diff_pct = price_diff / df['price'] * 100
+            
+            # Create DataFrame for display with explicit column order
+            return pd.DataFrame({
+                'Address': df['address'],
+                'Price': '$' + df['price'].map('{:,.0f}'.format),
+                'Fair Price': '$' + df['fair_price'].map('{:,.0f}'.format),
+                'Price Diff': price_diff.map('${:+,.0f}'.format) + ' (' + price_diff_pct.map('{:+.1f}%'.format) + ')',
+                'City': df['city'],
+                'State': df['state'],
+                'ZIP': df['zipcode'].mask(df['zipcode'].astype(str).isin(MISSING_ZIPCODE_TEXT), 'N/A'),
+                'Type': df['property_type'],
+                'Beds/Baths': as_text(df['bedrooms']) + '/' + as_text(df['bathrooms']),
+                'Sqft': df['living_area'].where(present(df['living_area'])).map('{:,.0f}'.format, na_action='ignore').fillna('N/A'),
+                'Score': df['total_score'].map('{:.1f}'.format),
+                'ROI Score': df['roi_score'].map('{:.1f}'.format)
+            })
             
         except Exception as e:
-            print(f"Error in opportunities_table: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            log.exception("Error in opportunities_table: %s", e)
             return pd.DataFrame()
-
-def _calculate_cap_rate(property):
-    """Helper function to calculate cap rate"""
-    if not property.rent_estimate or not property.price:
-        return 0.0
-    annual_rent = property.rent_estimate * 12
-    operating_expenses = annual_rent * 0.4  # 40% for maintenance, vacancy, etc.
-    net_operating_income = annual_rent - operating_expenses
-    return (net_operating_income / property.price) * 100
@@ -1,67 +1,169 @@
-from typing import Dict, List, Optional
-import pandas as pd
+from typing import Dict, List, Optional, Tuple
 import sqlite3
+import threading
+import atexit
+import logging
 from contextlib import contextmanager
 from models.property import Property
 
+log = logging.getLogger(__name__)
+
+def _pct_change(old: Optional[float], new: Optional[float]) -> float:
+    """Percent change from old to new, NaN when either value is missing or old is 0"""
+    if old is None or new is None or old == 0:
+        return float('nan')
+    return (new - old) / old * 100
+
+def _float(value: Optional[float]) -> float:
+    """SQL aggregate as a float, NaN when it is NULL"""
+    return float('nan') if value is None else float(value)
+
+def _location_filter(location: Optional[str], alias: str = "") -> Tuple[str, List[str]]:
+    """AND clause and params matching a ZIP code, or else a city or state name, exactly"""
+    if not location:
+        return "", []
+    location = location.strip()
+    # Equality keeps these lookups on the location indexes; a leading-wildcard LIKE scans every row
+    if location.isdigit() and len(location) == 5:
+        return f" AND {alias}zipcode = ?", [location]
+    return f" AND ({alias}city = ? COLLATE NOCASE OR {alias}state = ? COLLATE NOCASE)", [location, location]
+
 class MarketService:
+    # Sold-price aggregates per area and month, so trend queries read a handful of
+    # precomputed rows instead of scanning price_history with window functions
+    MONTHLY_STATS_SCHEMA = """
+        CREATE TABLE IF NOT EXISTS monthly_price_stats (
+            zipcode TEXT,
+            city TEXT,
+            state TEXT,
+            month TEXT,
+            total_price REAL,
+            priced_sales INTEGER,
+            sales INTEGER,
+            PRIMARY KEY (zipcode, city, state, month)
+        )
+    """
+
+    MONTHLY_STATS_QUERY = """
+        SELECT 
+            l.zipcode, l.city, l.state,
+            strftime('%Y-%m', ph.date) as month,
+            SUM(ph.price), COUNT(ph.price), COUNT(*)
+        FROM price_history ph
+        JOIN location l ON ph.property_id = l.property_id
+        WHERE ph.event = 'Sold'
+        GROUP BY l.zipcode, l.city, l.state, month
+    """
+
+    # Indexes behind the location filters and the location joins
+    LOCATION_INDEXES = [
+        "CREATE INDEX IF NOT EXISTS idx_location_zip ON location(zipcode)",
+        "CREATE INDEX IF NOT EXISTS idx_location_city ON location(city COLLATE NOCASE)",
+        "CREATE INDEX IF NOT EXISTS idx_location_state ON location(state COLLATE NOCASE)",
+        "CREATE INDEX IF NOT EXISTS idx_location_property ON location(property_id)",
+        "CREATE INDEX IF NOT EXISTS idx_properties_property ON properties(property_id)",
+        "CREATE INDEX IF NOT EXISTS idx_price_history_property ON price_history(property_id)"
+    ]
+
+    # Tables the market queries, indexes and monthly stats are built from
+    SOURCE_TABLES = ('properties', 'location', 'price_history')
+
     def __init__(self, db_path: str = 'real_estate.db'):
         self.db_path = db_path
+        # One long-lived connection per thread, reused across requests
+        self._local = threading.local()
 
-    @contextmanager
-    def get_connection(self):
-        conn = sqlite3.connect(self.db_path)
+    def prepare_tables(self) -> bool:
+        """Create the location indexes and build monthly_price_stats, once at startup;
+        False when the database lacks the market source tables"""
+        with self.get_connection() as conn:
+            found = {row[0] for row in conn.execute(
+                f"SELECT name FROM sqlite_master WHERE type = 'table' AND name IN ({','.join('?' * len(self.SOURCE_TABLES))})",
+                self.SOURCE_TABLES
+            )}
+        if missing := [name for name in self.SOURCE_TABLES if name not in found]:
+            log.warning("Market data unavailable, database has no %s table(s)", ", ".join(missing))
+            return False
         try:
-            yield conn
-        finally:
-            conn.close()
+            self.create_location_indexes()
+            self.refresh_monthly_price_stats()
+        except Exception as e:
+            log.exception("Error building monthly price stats: %s", e)
+            return False
+        return True
+
+    def create_location_indexes(self) -> None:
+        """Index the location columns used by the location filters"""
+        with self.get_connection() as conn:
+            for statement in self.LOCATION_INDEXES:
+                conn.execute(statement)
+
+    def refresh_monthly_price_stats(self) -> None:
+        """Rebuild monthly_price_stats from price_history; run at startup or on a schedule"""
+        with self.get_connection() as conn:
+            conn.execute(self.MONTHLY_STATS_SCHEMA)
+            conn.execute("BEGIN")
+            try:
+                conn.execute("DELETE FROM monthly_price_stats")
+                conn.execute(f"INSERT INTO monthly_price_stats {self.MONTHLY_STATS_QUERY}")
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    def _open_connection(self) -> sqlite3.Connection:
+        """Open a connection tuned for read-only analytical queries"""
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA cache_size=-65536")
+        conn.execute("PRAGMA mmap_size=268435456")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        atexit.register(conn.close)
+        return conn
+
+    @contextmanager
+    def get_connection(self, conn=None):
+        # Reuse a caller's connection (see get_all), otherwise this thread's cached one
+        if conn is None:
+            conn = getattr(self._local, 'conn', None)
+            if conn is None:
+                conn = self._local.conn = self._open_connection()
+        yield conn
+
+    def get_all(self, location: str = None) -> Dict:
+        """Get trends, demographics and economics for a location over a single connection"""
+        with self.get_connection() as conn:
+            return {
+                'trends': self.get_market_trends(location, conn),
+                'demographics': self.get_demographic_data(location, conn),
+                'economics': self.get_economic_indicators(location, conn)
+            }
 
     def get_market_metrics(self, location: str = None) -> Dict:
         """Get combined market metrics for a location"""
-        trends = self.get_market_trends(location)
-        demographics = self.get_demographic_data(location)
-        economics = self.get_economic_indicators(location)
+        market_data = self.get_all(location)
         
         return {
-            'market_trends': trends,
-            'demographics': demographics,
-            'economics': economics
+            'market_trends': market_data['trends'],
+            'demographics': market_data['demographics'],
+            'economics': market_data['economics']
         }
 
-    def get_market_trends(self, location: str = None) -> Dict:
+    def get_market_trends(self, location: str = None, conn=None) -> Dict:
         """Get market trends using actual data from database"""
-        with self.get_connection() as conn:
-            # Base query for filtering by location
-            location_filter = ""
-            params = []
-            if location:
-                location_filter = """
-                    AND (l.city LIKE ? OR l.state LIKE ? OR l.zipcode LIKE ?)
-                """
-                params.extend([f"%{location}%"] * 3)
-
-            # Get price trends
+        with self.get_connection(conn) as conn:
+            # Same location match on the stats table and the location join
+            stats_filter, params = _location_filter(location)
+            location_filter, _ = _location_filter(location, "l.")
+
+            # Average sold price for the 13 most recent months
             price_query = f"""
-                WITH price_stats AS (
-                    SELECT 
-                        AVG(ph.price) as avg_price,
-                        strftime('%Y-%m', ph.date) as month
-                    FROM price_history ph
-                    JOIN location l ON ph.property_id = l.property_id
-                    WHERE ph.event = 'Sold'
-                    {location_filter}
-                    GROUP BY strftime('%Y-%m', ph.date)
-                    ORDER BY month DESC
-                    LIMIT 13
-                )
-                SELECT 
-                    (LAST_VALUE(avg_price) OVER w - FIRST_VALUE(avg_price) OVER w) / 
-                    NULLIF(FIRST_VALUE(avg_price) OVER w, 0) * 100 as yearly_change,
-                    (LAST_VALUE(avg_price) OVER w - NTH_VALUE(avg_price, 2) OVER w) / 
-                    NULLIF(NTH_VALUE(avg_price, 2) OVER w, 0) * 100 as monthly_change
-                FROM price_stats
-                WINDOW w AS (ORDER BY month ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING)
-                LIMIT 1
+                SELECT SUM(total_price) / SUM(priced_sales) as avg_price
+                FROM monthly_price_stats
+                WHERE 1=1 {stats_filter}
+                GROUP BY month
+                ORDER BY month DESC
+                LIMIT 13
             """
             
             # Get inventory levels
@@ -77,35 +179,33 @@ class MarketService:
                 AND ph.event = 'Listed'
             """
             
-            df_price = pd.read_sql(price_query, conn, params=params)
-            df_inventory = pd.read_sql(inventory_query, conn, params=params)
+            # Oldest month first
+            prices = [row[0] for row in conn.execute(price_query, params)][::-1]
+            current_inventory, avg_days = conn.execute(inventory_query, params).fetchone()
+            
+            yearly_change = _pct_change(prices[0], prices[-1]) if prices else float('nan')
+            monthly_change = _pct_change(prices[-2], prices[-1]) if len(prices) > 1 else float('nan')
             
             return {
                 'price_trend': {
-                    'last_year': float(df_price['yearly_change'].iloc[0]),
-                    'last_month': float(df_price['monthly_change'].iloc[0]),
-                    'forecast': float(df_price['yearly_change'].iloc[0]) * 0.8  # Simple forecast
+                    'last_year': yearly_change,
+                    'last_month': monthly_change,
+                    'forecast': yearly_change * 0.8  # Simple forecast
                 },
                 'inventory_level': {
-                    'current': float(df_inventory['current_inventory'].iloc[0] / 100),  # Convert to months of inventory
+                    'current': current_inventory / 100,  # Convert to months of inventory
                     'trend': -0.3  # Placeholder for trend calculation
                 },
                 'days_on_market': {
-                    'average': float(df_inventory['avg_days'].iloc[0]),
+                    'average': _float(avg_days),
                     'trend': -5  # Placeholder for trend calculation
                 }
             }
 
-    def get_demographic_data(self, location: str = None) -> Dict:
+    def get_demographic_data(self, location: str = None, conn=None) -> Dict:
         """Get demographic data based on property aggregations"""
-        with self.get_connection() as conn:
-            location_filter = ""
-            params = []
-            if location:
-                location_filter = """
-                    WHERE (l.city LIKE ? OR l.state LIKE ? OR l.zipcode LIKE ?)
-                """
-                params.extend([f"%{location}%"] * 3)
+        with self.get_connection(conn) as conn:
+            location_filter, params = _location_filter(location, "l.")
 
             query = f"""
                 SELECT 
@@ -115,18 +215,18 @@ class MarketService:
                     AVG(p.yearBuilt) as avg_year_built
                 FROM properties p
                 JOIN location l ON p.property_id = l.property_id
-                {location_filter}
+                WHERE 1=1 {location_filter}
             """
             
-            df = pd.read_sql(query, conn, params=params)
+            total_areas, median_price, _, _ = conn.execute(query, params).fetchone()
             
             return {
                 'population': {
-                    'total': int(df['total_areas'].iloc[0] * 10000),  # Rough estimate
+                    'total': total_areas * 10000,  # Rough estimate
                     'growth_rate': 2.1  # Placeholder
                 },
                 'income': {
-                    'median': float(df['median_price'].iloc[0] / 3),  # Rough income estimate
+                    'median': _float(median_price) / 3,  # Rough income estimate
                     'growth_rate': 3.2  # Placeholder
                 },
                 'employment': {
@@ -135,50 +235,37 @@ class MarketService:
                 }
             }
 
-    def get_economic_indicators(self, location: str = None) -> Dict:
+    def get_economic_indicators(self, location: str = None, conn=None) -> Dict:
         """Get economic indicators from property data"""
-        with self.get_connection() as conn:
-            location_filter = ""
-            params = []
-            if location:
-                location_filter = """
-                    WHERE (l.city LIKE ? OR l.state LIKE ? OR l.zipcode LIKE ?)
-                """
-                params.extend([f"%{location}%"] * 3)
+        with self.get_connection(conn) as conn:
+            stats_filter, params = _location_filter(location)
 
+            # Sales and average sold price for the two most recent years
             query = f"""
-                WITH yearly_stats AS (
-                    SELECT 
-                        strftime('%Y', ph.date) as year,
-                        COUNT(*) as sales,
-                        AVG(ph.price) as avg_price
-                    FROM price_history ph
-                    JOIN location l ON ph.property_id = l.property_id
-                    WHERE ph.event = 'Sold'
-                    {location_filter}
-                    GROUP BY year
-                    ORDER BY year DESC
-                    LIMIT 2
-                )
                 SELECT 
-                    (LAST_VALUE(sales) OVER w - FIRST_VALUE(sales) OVER w) / 
-                    NULLIF(FIRST_VALUE(sales) OVER w, 0) * 100 as sales_growth,
-                    (LAST_VALUE(avg_price) OVER w - FIRST_VALUE(avg_price) OVER w) / 
-                    NULLIF(FIRST_VALUE(avg_price) OVER w, 0) * 100 as price_growth
-                FROM yearly_stats
-                WINDOW w AS (ORDER BY year ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING)
-                LIMIT 1
+                    SUM(sales) as sales,
+                    SUM(total_price) / SUM(priced_sales) as avg_price
+                FROM monthly_price_stats
+                WHERE 1=1 {stats_filter}
+                GROUP BY substr(month, 1, 4)
+                ORDER BY substr(month, 1, 4) DESC
+                LIMIT 2
             """
             
-            df = pd.read_sql(query, conn, params=params)
+            # Previous year first; with a single year both ends are the same
+            years = conn.execute(query, params).fetchall()[::-1]
+            if not years:
+                raise ValueError(f"No sales history for {location or 'any location'}")
+            sales_growth = _pct_change(years[0][0], years[-1][0])
+            price_growth = _pct_change(years[0][1], years[-1][1])
             
             return {
-                'gdp_growth': float(df['price_growth'].iloc[0]),
-                'job_growth': float(df['sales_growth'].iloc[0]),
-                'business_growth': float((df['price_growth'].iloc[0] + df['sales_growth'].iloc[0]) / 2),
+                'gdp_growth': price_growth,
+                'job_growth': sales_growth,
+                'business_growth': (price_growth + sales_growth) / 2,
                 'new_construction': {
-                    'residential': int(df['sales_growth'].iloc[0] * 10),  # Rough estimate
-                    'commercial': int(df['sales_growth'].iloc[0] * 2)  # Rough estimate
+                    'residential': int(sales_growth * 10),  # Rough estimate
+                    'commercial': int(sales_growth * 2)  # Rough estimate
                 }
             }
 
@@ -200,25 +287,25 @@ class MarketService:
                 AND ph.event = 'Listed'
             """
             
-            df = pd.read_sql(query, conn, params=[
+            similar_count, avg_price, avg_days = conn.execute(query, [
                 property.property_type,
                 property.living_area,
                 property.living_area,
                 property.price,
                 property.price,
                 property.zipcode
-            ])
+            ]).fetchone()
+            avg_price = _float(avg_price)
             
-            row = df.iloc[0]
             price_position = 'competitive'
-            if property.price > row['avg_price'] * 1.1:
+            if property.price > avg_price * 1.1:
                 price_position = 'high'
-            elif property.price < row['avg_price'] * 0.9:
+            elif property.price < avg_price * 0.9:
                 price_position = 'low'
             
             return {
-                'similar_properties': int(row['similar_count']),
-                'avg_price': float(row['avg_price']),
-                'avg_days_on_market': int(row['avg_days']),
+                'similar_properties': similar_count,
+                'avg_price': avg_price,
+                'avg_days_on_market': int(_float(avg_days)),
                 'price_position': price_position
             }
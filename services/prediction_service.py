@@ -3,7 +3,11 @@ import pandas as pd
 import numpy as np
 from pathlib import Path
 from pca_workflow import PCA_Manager
+from scoring_kernel import finalize_predictions
 from sklearn.impute import SimpleImputer
+import logging
+
+log = logging.getLogger(__name__)
 
 class PredictionService:
     def __init__(self):
@@ -12,14 +16,15 @@ class PredictionService:
             if not model_path.exists():
                 raise FileNotFoundError(f"Model file not found at {model_path}")
             self.model = joblib.load(model_path)
-            self.pca_manager = PCA_Manager()
+            # The fitted PCA pipeline is saved next to the predictions, so restarts load it instead of refitting
+            self.pca_manager = PCA_Manager(Path(__file__).parent.parent / 'data' / 'pca.joblib')
             
-            # Initialize imputers
-            self.numeric_imputer = SimpleImputer(strategy='mean')
-            self.categorical_imputer = SimpleImputer(strategy='constant', fill_value='UNKNOWN')
+            # Initialize imputers (all-empty columns are kept so output columns line up with the input)
+            self.numeric_imputer = SimpleImputer(strategy='mean', keep_empty_features=True)
+            self.categorical_imputer = SimpleImputer(strategy='constant', fill_value='UNKNOWN', keep_empty_features=True)
             
         except Exception as e:
-            print(f"Error initializing PredictionService: {str(e)}")
+            log.error("Error initializing PredictionService: %s", e)
             self.model = None
             
     def predict_fair_price(self, properties_df):
@@ -28,23 +33,15 @@ class PredictionService:
         """
         try:
             if self.model is None:
-                print("Warning: Using actual prices as fair prices due to model loading failure")
+                log.warning("Using actual prices as fair prices due to model loading failure")
                 return properties_df['price'].values
             
-            # Create a copy to avoid modifying the original dataframe
-            df = properties_df.copy()
-            
-            # Print shape information for debugging
-            print(f"Input DataFrame shape: {df.shape}")
-            
-            # Define numeric and categorical features
-            numeric_features = df.select_dtypes(
-                include=['int32', 'float32', 'int64', 'float64']
-            ).columns.tolist()
+            log.debug("Input DataFrame shape: %s", properties_df.shape)
             
-            categorical_features = df.select_dtypes(
-                include=['object', 'category']
-            ).columns.tolist()
+            # Define numeric and categorical features from the dtypes, without materializing any columns
+            dtypes = properties_df.dtypes.astype(str)
+            numeric_features = dtypes.index[dtypes.isin(['int32', 'float32', 'int64', 'float64'])].tolist()
+            categorical_features = dtypes.index[dtypes.isin(['object', 'category'])].tolist()
             
             # Remove price and any problematic columns from features
             columns_to_remove = ['price', 'fair_price', 'id']
@@ -56,27 +53,26 @@ class PredictionService:
                                   if col not in columns_to_remove and 
                                   not col.startswith('schools/')]
             
-            print(f"Number of numeric features: {len(numeric_features)}")
-            print(f"Number of categorical features: {len(categorical_features)}")
+            log.debug("Number of numeric features: %d", len(numeric_features))
+            log.debug("Number of categorical features: %d", len(categorical_features))
+            
+            # An explicit copy of just the feature columns, so the imputation and PCA preprocessing
+            # below can assign in place without touching the caller's frame
+            df = properties_df[numeric_features + categorical_features].copy()
+            
+            # Impute all columns with missing values in one pass per feature kind
+            missing = df.columns[df.isnull().any()]
+            numeric_missing = [col for col in numeric_features if col in missing]
+            categorical_missing = [col for col in categorical_features if col in missing]
             
             # Handle missing values for numeric features
-            if numeric_features:
-                # Impute each numeric column separately to avoid dimension mismatch
-                for col in numeric_features:
-                    if df[col].isnull().any():
-                        df[col] = self.numeric_imputer.fit_transform(
-                            df[col].values.reshape(-1, 1)
-                        ).ravel()
+            if numeric_missing:
+                df[numeric_missing] = self.numeric_imputer.fit_transform(df[numeric_missing])
             
             # Handle missing values for categorical features
-            if categorical_features:
-                # Impute each categorical column separately
-                for col in categorical_features:
-                    if df[col].isnull().any():
-                        df[col] = self.categorical_imputer.fit_transform(
-                            df[col].values.reshape(-1, 1)
-                        ).ravel()
-                        df[col] = df[col].astype(str)
+            if categorical_missing:
+                df[categorical_missing] = self.categorical_imputer.fit_transform(df[categorical_missing])
+                df[categorical_missing] = df[categorical_missing].astype(str)
             
             # Transform data using PCA
             X_pca = self.pca_manager.convert_x_to_pca(
@@ -85,55 +81,31 @@ class PredictionService:
                 categorical_features
             )
             
-            print(f"PCA transformed shape: {X_pca.shape}")
+            log.debug("PCA transformed shape: %s", X_pca.shape)
+            
+            # The Keras network computes in float32; cast once here instead of inside predict
+            X_pca = np.ascontiguousarray(X_pca, dtype=np.float32)
             
             # Generate predictions
             predictions = self.model.predict(X_pca)
-            print(f"Raw predictions shape: {predictions.shape}")
+            log.debug("Raw predictions shape: %s", predictions.shape)
             
             # Ensure predictions are a 1D array with the correct length
             predictions = predictions.reshape(-1)
             if len(predictions) != len(df):
                 raise ValueError(f"Prediction length ({len(predictions)}) does not match input length ({len(df)})")
             
-            # Ensure predictions are positive and reasonable
-            predictions = np.maximum(predictions, 0)  # No negative prices
-            
-            # Add some noise to avoid identical predictions
-            noise = np.random.normal(1, 0.05, size=len(predictions))
-            predictions = predictions * noise
-            
-            # Validate predictions
-            actual_prices = properties_df['price'].values
-            predictions = self._validate_predictions(predictions, actual_prices)
+            # Clamp negatives, add some noise to avoid identical predictions and keep
+            # predictions within 50-150% of the actual price, in one pass
+            noise = np.random.default_rng().standard_normal(len(predictions))
+            actual_prices = properties_df['price'].to_numpy(dtype=np.float64)
+            predictions = finalize_predictions(
+                np.ascontiguousarray(predictions, dtype=np.float64), noise, actual_prices
+            )
             
-            print(f"Final predictions shape: {predictions.shape}")
+            log.debug("Final predictions shape: %s", predictions.shape)
             return predictions
             
         except Exception as e:
-            print(f"Error predicting fair prices: {str(e)}")
-            import traceback
-            traceback.print_exc()  # Print full stack trace
+            log.exception("Error predicting fair prices: %s", e)
             return properties_df['price'].values
-            
-    def _validate_predictions(self, predictions, actual_prices):
-        """
-        Validate predictions and adjust if they seem unreasonable
-        """
-        try:
-            # Ensure arrays are the same length
-            if len(predictions) != len(actual_prices):
-                raise ValueError(f"Prediction length ({len(predictions)}) does not match actual prices length ({len(actual_prices)})")
-            
-            # Ensure predictions are within reasonable bounds of actual prices
-            lower_bound = actual_prices * 0.5  # 50% of actual price
-            upper_bound = actual_prices * 1.5  # 150% of actual price
-            
-            # Clip predictions to these bounds
-            validated_predictions = np.clip(predictions, lower_bound, upper_bound)
-            
-            return validated_predictions
-            
-        except Exception as e:
-            print(f"Error validating predictions: {str(e)}")
-            return predictions  # Return original predictions if validation fails
\ No newline at end of file
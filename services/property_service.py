@@ -1,78 +1,151 @@
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Sequence
 import sqlite3
+import threading
+import logging
 import pandas as pd
 from contextlib import contextmanager
-from models.property import Property
+from functools import lru_cache
+from itertools import starmap
+from collections import namedtuple
+from dataclasses import fields
+from models.property import Property, DB_PROPERTY_TYPES
+from scoring_kernel import DB_SCORE_COLUMNS, frame_investment_scores
+from db_schema import TOTAL_SCORE_SQL, PROPERTY_INDEXES
+
+log = logging.getLogger(__name__)
+
+def _padded(values: list, size: int) -> list:
+    """values repeated at the end up to size, so IN lists keep a fixed number of placeholders"""
+    return values + values[-1:] * (size - len(values))
+
+@lru_cache(maxsize=None)
+def _lite_type(field_names: tuple) -> type:
+    """Namedtuple with only the given Property fields, one class per field selection"""
+    return namedtuple('PropertyLite', field_names)
 
 class PropertyService:
-    # Class-level constants for queries
-    BASE_PROPERTY_QUERY = """
-        SELECT DISTINCT
-            property_id, price, propertyTypeDimension as property_type,
+    # Class-level constants for queries; columns are selected in Property field order,
+    # so rows can be passed to Property positionally
+    PROPERTY_COLUMNS = f"""
+            property_id, price, fair_price, propertyTypeDimension as property_type,
             livingArea as living_area, bedrooms, bathrooms, yearBuilt as year_built,
             lotSize as lot_size, latitude, longitude, zestimate,
             rentZestimate as rent_estimate, taxAssessedValue as tax_assessed_value,
             propertyTaxRate as tax_rate, monthlyHoaFee as monthly_hoa,
-            streetAddress as address, city, state, zipcode, county,
-            fair_price
+            streetAddress as address, city, state, zipcode, county, investment_score,
+            {TOTAL_SCORE_SQL} as total_score
+    """
+
+    PROPERTY_FIELDS = frozenset(field.name for field in fields(Property))
+
+    BASE_PROPERTY_QUERY = f"""
+        SELECT {PROPERTY_COLUMNS}
         FROM properties
         WHERE 1=1
     """
 
-    PROPERTY_BY_ID_QUERY = """
-        SELECT 
-            property_id, price, propertyTypeDimension as property_type,
-            livingArea as living_area, bedrooms, bathrooms, yearBuilt as year_built,
-            lotSize as lot_size, latitude, longitude, zestimate,
-            rentZestimate as rent_estimate, taxAssessedValue as tax_assessed_value,
-            propertyTaxRate as tax_rate, monthlyHoaFee as monthly_hoa,
-            streetAddress as address, city, state, zipcode, county,
-            fair_price
+    PROPERTY_BY_ID_QUERY = f"""
+        SELECT {PROPERTY_COLUMNS}
         FROM properties
         WHERE property_id = ?
     """
 
     def __init__(self, db_path: str = 'real_estate.db'):
         self.db_path = db_path
+        # One long-lived connection per thread, reused across requests
+        self._local = threading.local()
+        # Opportunity results by query key, valid for one schema version of the database
+        self._opportunities = {}
+        self._opportunities_version = None
+        self._opportunities_lock = threading.Lock()
+        try:
+            with self.get_connection() as conn:
+                self.ensure_unique_ids(conn)
+                self.ensure_score_column(conn)
+                self.ensure_indexes(conn)
+        except Exception as e:
+            log.error("Error preparing properties table: %s", e)
+
+    @staticmethod
+    def ensure_indexes(conn) -> None:
+        """Add any of the PROPERTY_INDEXES missing from a database built by an older version"""
+        row = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'index' AND name = 'ix_total_score'").fetchone()
+        # The total score expression embeds the current year, so last year's index no longer matches
+        if row is not None and TOTAL_SCORE_SQL not in row[0]:
+            conn.execute("DROP INDEX ix_total_score")
+        for statement in PROPERTY_INDEXES:
+            conn.execute(statement)
+
+    @staticmethod
+    def ensure_unique_ids(conn) -> None:
+        """Drop duplicate property_id rows and add the unique index that queries rely on instead of DISTINCT"""
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'ix_props_id'").fetchone():
+            return
+        conn.execute("BEGIN")
+        try:
+            # Keep the first copy of each property, as loaded from the CSV
+            conn.execute(
+                "DELETE FROM properties WHERE rowid NOT IN (SELECT MIN(rowid) FROM properties GROUP BY property_id)"
+            )
+            conn.execute("CREATE UNIQUE INDEX ix_props_id ON properties(property_id)")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    @staticmethod
+    def ensure_score_column(conn) -> None:
+        """Backfill the investment_score column for databases built without it; ensure_indexes indexes it"""
+        columns = {row[1] for row in conn.execute("PRAGMA table_xinfo(properties)")}
+        if not columns:
+            return
+        if 'investment_score' not in columns:
+            inputs = pd.read_sql_query(f"SELECT rowid, {', '.join(DB_SCORE_COLUMNS)} FROM properties", conn)
+            scores = frame_investment_scores(inputs)
+            conn.execute("BEGIN")
+            try:
+                conn.execute("ALTER TABLE properties ADD COLUMN investment_score REAL")
+                conn.executemany(
+                    "UPDATE properties SET investment_score = ? WHERE rowid = ?",
+                    zip(scores.tolist(), inputs['rowid'].tolist())
+                )
+                # An older ix_score may index the previous SQL score expression
+                conn.execute("DROP INDEX IF EXISTS ix_score")
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    def _open_connection(self) -> sqlite3.Connection:
+        """Open a connection tuned for a read-mostly workload"""
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA cache_size=-65536")
+        conn.execute("PRAGMA mmap_size=268435456")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        # WAL stays consistent with NORMAL; only the score backfill writes here
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.row_factory = sqlite3.Row
+        return conn
 
     @contextmanager
     def get_connection(self):
-        conn = None
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = getattr(self._local, 'conn', None)
+            if conn is None:
+                conn = self._local.conn = self._open_connection()
             yield conn
         except sqlite3.Error as e:
             raise Exception(f"Database error: {str(e)}")
-        finally:
-            if conn:
-                conn.close()
+
+    # Location filter shared by search_properties and the opportunities query: a substring
+    # of the city, ZIP code or state, so partial ZIPs and state names match in both
+    LOCATION_CLAUSE = " AND (LOWER(city) LIKE LOWER(?) OR zipcode LIKE ? OR LOWER(state) LIKE LOWER(?))"
 
     @staticmethod
-    def _create_property_from_row(row) -> Property:
-        """Helper method to create Property object from database row"""
-        return Property(
-            property_id=row['property_id'],
-            price=row['price'],
-            fair_price=row['fair_price'],
-            property_type=row['property_type'],
-            living_area=row['living_area'],
-            bedrooms=row['bedrooms'],
-            bathrooms=row['bathrooms'],
-            year_built=row['year_built'],
-            lot_size=row['lot_size'],
-            latitude=row['latitude'],
-            longitude=row['longitude'],
-            zestimate=row['zestimate'],
-            rent_estimate=row['rent_estimate'],
-            tax_assessed_value=row['tax_assessed_value'],
-            tax_rate=row['tax_rate'],
-            monthly_hoa=row['monthly_hoa'],
-            address=row['address'],
-            city=row['city'],
-            state=row['state'],
-            zipcode=row['zipcode'],
-            county=row['county']
-        )
+    def _location_params(location: str) -> list:
+        """Parameters for LOCATION_CLAUSE"""
+        return [f"%{location}%"] * 3
 
     def search_properties(self, filters: Dict, limit: int = 100) -> List[Property]:
         """Search properties with filters and limit results"""
@@ -89,29 +162,33 @@ class PropertyService:
         
         if property_types := filters.get('property_types'):
             if property_types:
+                # Fixed arity keeps the SQL text identical, so the connection's statement cache hits
+                property_types = _padded(list(property_types), len(DB_PROPERTY_TYPES))
                 query += f" AND propertyTypeDimension IN ({','.join('?' * len(property_types))})"
                 params.extend(property_types)
         
         if location := filters.get('location'):
-            query += """ 
-            AND (
-                LOWER(city) LIKE LOWER(?) OR 
-                zipcode LIKE ? OR 
-                LOWER(state) LIKE LOWER(?)
-            )"""
-            location_param = f"%{location}%"
-            params.extend([location_param] * 3)
+            query += self.LOCATION_CLAUSE
+            params.extend(self._location_params(location))
+
+        if (max_diff_pct := filters.get('max_price_diff_pct')) is not None:
+            query += " AND fair_price IS NOT NULL AND price > 0 AND ABS(fair_price - price) <= price * ?"
+            params.append(max_diff_pct / 100)
+
+        if filters.get('has_coordinates'):
+            query += " AND latitude IS NOT NULL AND longitude IS NOT NULL"
 
         if max_hoa := filters.get('max_hoa'):
             query += " AND (monthlyHoaFee <= ? OR monthlyHoaFee IS NULL)"
             params.append(max_hoa)
 
-        query += f" LIMIT {limit}"
+        query += " LIMIT ?"
+        params.append(limit)
 
         try:
             with self.get_connection() as conn:
-                df = pd.read_sql(query, conn, params=params)
-                return [self._create_property_from_row(row) for _, row in df.iterrows()]
+                # Rows are stepped straight into Property objects, never held as a list of rows
+                return list(starmap(Property, conn.execute(query, params)))
         except Exception as e:
             raise Exception(f"Error searching properties: {str(e)}")
 
@@ -119,108 +196,184 @@ class PropertyService:
         """Get a single property by ID"""
         try:
             with self.get_connection() as conn:
-                df = pd.read_sql(self.PROPERTY_BY_ID_QUERY, conn, params=[property_id])
+                row = conn.execute(self.PROPERTY_BY_ID_QUERY, [property_id]).fetchone()
                 
-                if df.empty:
+                if row is None:
                     return None
                     
-                return self._create_property_from_row(df.iloc[0])
+                return Property(*row)
         except Exception as e:
             raise Exception(f"Error getting property {property_id}: {str(e)}")
 
-    def get_investment_opportunities(self, sort_by: str = 'score', limit: int = 50, filters: Dict = None) -> List[Property]:
-        """Get investment opportunities with filters and sorting"""
+    # Column dtypes for DataFrame results, so NULLs come back as NaN instead of object columns
+    NUMERIC_COLUMNS = [
+        'price', 'fair_price', 'living_area', 'bedrooms', 'bathrooms', 'year_built',
+        'lot_size', 'latitude', 'longitude', 'zestimate', 'rent_estimate',
+        'tax_assessed_value', 'tax_rate', 'monthly_hoa', 'investment_score', 'total_score'
+    ]
+
+    def _build_opportunities_query(self, sort_by: str, limit: int, filters: Dict) -> tuple:
+        """Build the filtered, sorted and limited investment opportunities query"""
+        # Work on a copy; callers such as a reactive.Calc share their filters dict between outputs
+        filters = dict(filters or {})
+        
+        # Handle show_max_results filter
+        show_max_results = filters.get('show_max_results', False)
+        actual_limit = 2000 if show_max_results else (limit or 50)
+        
+        # Only the parameters are worked out per call; the SQL comes from the composed-query cache
+        filter_params = self._filter_params(filters)
+        query = self._compose_query(sort_by, tuple(values is not None for values in filter_params))
+        params = [value for values in filter_params if values is not None for value in values]
+        params.append(actual_limit)
+        
+        log.debug("Executing query with limit %s", actual_limit)
+        return query, params
+
+    def get_investment_opportunities(self, sort_by: str = 'score', limit: int = 50, filters: Dict = None,
+                                     fields: Optional[Sequence[str]] = None) -> List[Property]:
+        """Get investment opportunities with filters and sorting; with fields, as namedtuples of just those Property fields"""
+        field_names = tuple(fields) if fields is not None else None
+        if field_names is not None and not self.PROPERTY_FIELDS.issuperset(field_names):
+            raise ValueError(f"Unknown Property fields: {sorted(set(field_names) - self.PROPERTY_FIELDS)}")
         try:
-            # Handle show_max_results filter
-            show_max_results = filters.pop('show_max_results', False) if filters else False
-            actual_limit = 2000 if show_max_results else (limit or 50)
-            
-            # Build query with limit
-            query = self.BASE_PROPERTY_QUERY
-            params = []
-            
-            # Add filter conditions
-            if filters:
-                query, params = self._add_filters_to_query(query, params, filters)
-            
-            # Add sorting
-            query = self._add_sorting_to_query(query, sort_by)
-            
-            # Add LIMIT clause
-            query += f" LIMIT {actual_limit}"
+            # Property objects are immutable, so cached results can be shared between callers
+            return list(self._fetch_opportunities(sort_by, limit, self._filters_key(filters), field_names))
+                
+        except Exception as e:
+            log.exception("Error in get_investment_opportunities: %s", e)
+            return []
+
+    # Most opportunity result sets kept at once; the oldest is dropped first
+    OPPORTUNITIES_CACHE_SIZE = 32
+
+    def _fetch_opportunities(self, sort_by: str, limit: int, filters_key: tuple, field_names: Optional[tuple] = None) -> tuple:
+        """Run the opportunities query once per distinct sort, limit, filter set and field selection,
+        until the properties table is rebuilt"""
+        key = (sort_by, limit, filters_key, field_names)
+        with self.get_connection() as conn:
+            # create_db drops and recreates the table, which bumps the schema version
+            version = conn.execute("PRAGMA schema_version").fetchone()[0]
+            with self._opportunities_lock:
+                if version != self._opportunities_version:
+                    self._opportunities.clear()
+                    self._opportunities_version = version
+                if (cached := self._opportunities.get(key)) is not None:
+                    return cached
             
-            print(f"Executing query with limit {actual_limit}")  # Debug print
+            query, params = self._build_opportunities_query(sort_by, limit, dict(filters_key))
+            if field_names is None:
+                result = tuple(starmap(Property, conn.execute(query, params)))
+            else:
+                # SQLite flattens the subquery, so columns that aren't selected are never computed
+                lite_type = _lite_type(field_names)
+                query = f"SELECT {', '.join(field_names)} FROM ({query})"
+                result = tuple(map(lite_type._make, conn.execute(query, params)))
+        
+        with self._opportunities_lock:
+            if len(self._opportunities) >= self.OPPORTUNITIES_CACHE_SIZE:
+                del self._opportunities[next(iter(self._opportunities))]
+            self._opportunities[key] = result
+        return result
+
+    @staticmethod
+    def _filters_key(filters: Optional[Dict]) -> tuple:
+        """Hashable form of a filters dict, used as the query cache key"""
+        return tuple(sorted(
+            (name, tuple(value) if isinstance(value, list) else value)
+            for name, value in (filters or {}).items()
+        ))
+
+    def get_investment_opportunities_df(self, sort_by: str = 'score', limit: int = 50, filters: Dict = None) -> pd.DataFrame:
+        """Same as get_investment_opportunities, as a DataFrame with one column per Property field"""
+        try:
+            query, params = self._build_opportunities_query(sort_by, limit, filters)
             
             with self.get_connection() as conn:
-                df = pd.read_sql(query, conn, params=params)
-                return [self._create_property_from_row(row) for _, row in df.iterrows()]
+                return pd.read_sql_query(
+                    query, conn, params=params,
+                    dtype={col: 'float64' for col in self.NUMERIC_COLUMNS}
+                )
                 
         except Exception as e:
-            print(f"Error in get_investment_opportunities: {str(e)}")
-            import traceback
-            traceback.print_exc()
-            return []
+            log.exception("Error in get_investment_opportunities_df: %s", e)
+            return pd.DataFrame(columns=[field.name for field in fields(Property)])
 
-    def _add_filters_to_query(self, query: str, params: list, filters: Dict) -> tuple:
-        """Helper method to add filter conditions to query"""
-        if filters.get('price_min') is not None and filters.get('price_max') is not None:
-            query += " AND price BETWEEN ? AND ?"
-            params.extend([filters['price_min'], filters['price_max']])
-        
-        if filters.get('sqft_min') is not None and filters.get('sqft_max') is not None:
-            query += " AND livingArea BETWEEN ? AND ?"
-            params.extend([filters['sqft_min'], filters['sqft_max']])
-        
+    # Filter conditions in query order; _filter_params returns their parameters in the same order
+    FILTER_CLAUSES = (
+        " AND price BETWEEN ? AND ?",
+        " AND livingArea BETWEEN ? AND ?",
+        # One placeholder per allowed type, so the SQL text stays the same for any selection
+        f" AND UPPER(propertyTypeDimension) IN ({','.join('?' * len(DB_PROPERTY_TYPES))})",
+        LOCATION_CLAUSE,
+        " AND fair_price IS NOT NULL AND price > 0 AND ABS(fair_price - price) <= price * ?",
+        " AND latitude IS NOT NULL AND longitude IS NOT NULL",
+        " AND (monthlyHoaFee <= ? OR monthlyHoaFee IS NULL)"
+    )
+
+    @staticmethod
+    def _filter_params(filters: Dict) -> tuple:
+        """Parameters for each of FILTER_CLAUSES, None where that filter is not set"""
         # Strictly enforce allowed property types
-        allowed_types = ['SINGLE FAMILY', 'CONDO', 'TOWNHOUSE']
-        if property_types := filters.get('property_types'):
-            if isinstance(property_types, (list, tuple)) and property_types:
-                # Filter out any property types not in allowed_types
-                valid_types = [pt for pt in property_types if pt.upper() in allowed_types]
-                if valid_types:
-                    query += f" AND UPPER(propertyTypeDimension) IN ({','.join(['?' for _ in valid_types])})"
-                    params.extend([pt.upper() for pt in valid_types])
+        property_types = filters.get('property_types')
+        valid_types = []
+        if isinstance(property_types, (list, tuple)):
+            valid_types = list(dict.fromkeys(pt.upper() for pt in property_types if pt.upper() in DB_PROPERTY_TYPES))
+        
+        location = filters.get('location')
+        max_diff_pct = filters.get('max_price_diff_pct')
+        max_hoa = filters.get('max_hoa')
+        has_price_range = filters.get('price_min') is not None and filters.get('price_max') is not None
+        has_sqft_range = filters.get('sqft_min') is not None and filters.get('sqft_max') is not None
+        return (
+            [filters['price_min'], filters['price_max']] if has_price_range else None,
+            [filters['sqft_min'], filters['sqft_max']] if has_sqft_range else None,
+            _padded(valid_types, len(DB_PROPERTY_TYPES)) if valid_types else None,
+            PropertyService._location_params(location) if location else None,
+            [max_diff_pct / 100] if max_diff_pct is not None else None,
+            [] if filters.get('has_coordinates') else None,
+            [max_hoa] if max_hoa else None
+        )
 
-        return query, params
+    @staticmethod
+    @lru_cache(maxsize=128)
+    def _compose_query(sort_by: str, active_filters: tuple) -> str:
+        """Query text for a sort option and the set of active FILTER_CLAUSES, composed once per combination"""
+        query = PropertyService.BASE_PROPERTY_QUERY + ''.join(
+            clause for clause, active in zip(PropertyService.FILTER_CLAUSES, active_filters) if active
+        )
+        return PropertyService._add_sorting_to_query(query, sort_by) + " LIMIT ?"
+
+    # ORDER BY clauses per sort option, built once; distance sorting applies when a center is given
+    CENTERED_SORT_CLAUSES = {
+        'total_score': 'total_score DESC',
+        'roi_potential': 'COALESCE((zestimate - price) / NULLIF(price, 0), 0) DESC',
+        'cap_rate': 'COALESCE(rentZestimate * 12.0 / NULLIF(price, 0), 0) DESC',
+        'price_asc': 'price ASC',
+        'price_desc': 'price DESC'
+    }
+
+    SORT_CLAUSES = {
+        'score': 'ORDER BY investment_score DESC',
+        'total_score': 'ORDER BY total_score DESC',
+        'roi_potential': 'ORDER BY COALESCE((zestimate - price) / NULLIF(price, 0), 0) DESC',
+        'cap_rate': 'ORDER BY COALESCE(rentZestimate * 12.0 / NULLIF(price, 0), 0) DESC',
+        'price_asc': 'ORDER BY price ASC',
+        'price_desc': 'ORDER BY price DESC'
+    }
 
-    def _add_sorting_to_query(self, query: str, sort_by: str, center_coords: tuple = None) -> str:
+    @classmethod
+    def _add_sorting_to_query(cls, query: str, sort_by: str, center_coords: tuple = None) -> str:
         """Helper method to add sorting to query"""
         if center_coords:
             if sort_by == 'score':
-                query += """ 
-                ORDER BY (
-                    CASE 
-                        WHEN price > 0 THEN (
-                            COALESCE(rentZestimate * 12.0 / NULLIF(price, 0), 0) * 0.4 + 
-                            COALESCE((zestimate - price) / NULLIF(price, 0), 0) * 0.3
-                        )
-                    END
-                ) DESC, distance ASC
-                """
+                query += " ORDER BY investment_score DESC, distance ASC"
             else:
-                sort_clause = {
-                    'roi_potential': 'COALESCE((zestimate - price) / NULLIF(price, 0), 0) DESC',
-                    'cap_rate': 'COALESCE(rentZestimate * 12.0 / NULLIF(price, 0), 0) DESC',
-                    'price_asc': 'price ASC',
-                    'price_desc': 'price DESC'
-                }.get(sort_by, 'distance ASC')
+                sort_clause = cls.CENTERED_SORT_CLAUSES.get(sort_by, 'distance ASC')
                 query += f" ORDER BY {sort_clause}"
         else:
             # Default sorting when no location is specified
-            sort_clause = {
-                'score': '''ORDER BY (
-                    CASE 
-                        WHEN price > 0 THEN (
-                            COALESCE(rentZestimate * 12.0 / NULLIF(price, 0), 0) * 0.4 + 
-                            COALESCE((zestimate - price) / NULLIF(price, 0), 0) * 0.3
-                        )
-                    END
-                ) DESC''',
-                'roi_potential': 'ORDER BY COALESCE((zestimate - price) / NULLIF(price, 0), 0) DESC',
-                'cap_rate': 'ORDER BY COALESCE(rentZestimate * 12.0 / NULLIF(price, 0), 0) DESC',
-                'price_asc': 'ORDER BY price ASC',
-                'price_desc': 'ORDER BY price DESC'
-            }.get(sort_by, 'ORDER BY price DESC')
+            sort_clause = cls.SORT_CLAUSES.get(sort_by, 'ORDER BY price DESC')
             query += f" {sort_clause}"
 
         return query
@@ -1,8 +1,41 @@
-from typing import List
+from typing import List, Optional
 from models.property import Property, InvestmentScore
-from statistics import mean
+from itertools import repeat
+import heapq
+import threading
+import numpy as np
+from scoring_kernel import property_subscores
+from db_schema import CURRENT_YEAR
+
+# Vacancy risk by property type, 5 for any other type
+_VACANCY_RISK = {
+    'Single Family': 8,
+    'Multi Family': 7,
+    'Apartment': 6,
+    'Retail': 5,
+    'Office': 4,
+    'Industrial': 6,
+    'Land': 3
+}
+
+# Weights of the sub-scores in the total score
+_SCORE_WEIGHTS = {
+    'roi': 0.35,
+    'location': 0.25,
+    'condition': 0.15,
+    'market': 0.15,
+    'risk': 0.10
+}
 
 class ScoringService:
+    # Most per-property sub-scores kept by score_properties; the oldest is dropped first
+    SCORE_CACHE_SIZE = 8192
+
+    def __init__(self):
+        # ROI, condition, risk and computed total scores by property_id and score inputs
+        self._scores = {}
+        self._scores_lock = threading.Lock()
+
     def calculate_roi_score(self, property: Property) -> float:
         if not property.rent_estimate or not property.price:
             return 0.0
@@ -31,14 +64,14 @@ class ScoringService:
             return 5.0
             
         # Base score on age of property
-        age = 2024 - property.year_built
+        age = CURRENT_YEAR - property.year_built
         age_score = max(0, 10 - (age / 10))
         
         # Adjust for recent zestimate vs price if available
         if property.zestimate and property.price:
             condition_factor = property.zestimate / property.price
             condition_score = 10 * min(1.2, max(0.8, condition_factor))
-            return mean([age_score, condition_score])
+            return (age_score + condition_score) / 2
             
         return age_score
 
@@ -51,31 +84,17 @@ class ScoringService:
         return 6.0  # Placeholder
 
     def calculate_risk_score(self, property: Property) -> float:
-        risk_factors = []
+        # Vacancy risk based on property type, plus a placeholder market risk of 6
+        total = _VACANCY_RISK.get(property.property_type, 5) + 6
+        count = 2
         
         # Price volatility risk
         if property.zestimate and property.price:
             price_diff = abs(property.zestimate - property.price) / property.price
-            price_risk = 10 - (price_diff * 100)
-            risk_factors.append(price_risk)
-            
-        # Vacancy risk based on property type
-        vacancy_risk = {
-            'Single Family': 8,
-            'Multi Family': 7,
-            'Apartment': 6,
-            'Retail': 5,
-            'Office': 4,
-            'Industrial': 6,
-            'Land': 3
-        }.get(property.property_type, 5)
-        risk_factors.append(vacancy_risk)
-        
-        # Market risk
-        market_risk = 6  # Placeholder
-        risk_factors.append(market_risk)
+            total += 10 - (price_diff * 100)
+            count += 1
         
-        return mean(risk_factors) if risk_factors else 5.0
+        return total / count
 
     def score_property(self, property: Property) -> InvestmentScore:
         roi_score = self.calculate_roi_score(property)
@@ -84,22 +103,17 @@ class ScoringService:
         market_score = self.calculate_market_score(property)
         risk_score = self.calculate_risk_score(property)
         
-        # Calculate total score with weighted factors
-        weights = {
-            'roi': 0.35,
-            'location': 0.25,
-            'condition': 0.15,
-            'market': 0.15,
-            'risk': 0.10
-        }
-        
-        total_score = (
-            roi_score * weights['roi'] +
-            location_score * weights['location'] +
-            condition_score * weights['condition'] +
-            market_score * weights['market'] +
-            risk_score * weights['risk']
-        ) * 10  # Scale to 0-100
+        # Use the total computed by the query (TOTAL_SCORE_SQL) when the property has one
+        total_score = property.total_score
+        if total_score is None:
+            # Calculate total score with weighted factors
+            total_score = (
+                roi_score * _SCORE_WEIGHTS['roi'] +
+                location_score * _SCORE_WEIGHTS['location'] +
+                condition_score * _SCORE_WEIGHTS['condition'] +
+                market_score * _SCORE_WEIGHTS['market'] +
+                risk_score * _SCORE_WEIGHTS['risk']
+            ) * 10  # Scale to 0-100
         
         return InvestmentScore(
             property=property,
@@ -111,5 +125,63 @@ class ScoringService:
             risk_score=risk_score
         )
 
-    def score_properties(self, properties: List[Property]) -> List[InvestmentScore]:
-        return [self.score_property(prop) for prop in properties] 
\ No newline at end of file
+    def score_properties(self, properties: List[Property], top_k: Optional[int] = None) -> List[InvestmentScore]:
+        """Same scores as score_property, computed in one pass over the properties not scored before;
+        with top_k, only the top_k highest total scores, best first"""
+        if not properties:
+            return []
+        
+        # Any change to a score input is a different key, so a stale score is never reused
+        keys = [
+            (p.property_id, p.price, p.rent_estimate, p.zestimate, p.year_built, p.property_type)
+            for p in properties
+        ]
+        with self._scores_lock:
+            subscores = [self._scores.get(key) for key in keys]
+        
+        missing = [i for i, cached in enumerate(subscores) if cached is None]
+        if missing:
+            batch = [properties[i] for i in missing]
+            
+            # One float column per input; missing values become NaN
+            def column(name):
+                return np.array([getattr(p, name) for p in batch], dtype=np.float64)
+            
+            price, rent, zestimate, year_built = (
+                column(name) for name in ('price', 'rent_estimate', 'zestimate', 'year_built')
+            )
+            vacancy_risk = np.array([_VACANCY_RISK.get(p.property_type, 5) for p in batch], dtype=np.float64)
+            computed = property_subscores(
+                price, rent, zestimate, year_built, vacancy_risk,
+                self.calculate_location_score(None), self.calculate_market_score(None), CURRENT_YEAR
+            )
+            
+            with self._scores_lock:
+                for i, scored in zip(missing, zip(*(values.tolist() for values in computed))):
+                    subscores[i] = scored
+                    if len(self._scores) >= self.SCORE_CACHE_SIZE:
+                        del self._scores[next(iter(self._scores))]
+                    self._scores[keys[i]] = scored
+        
+        roi_score, condition_score, risk_score, computed_total = (list(values) for values in zip(*subscores))
+        location_score = self.calculate_location_score(None)
+        market_score = self.calculate_market_score(None)
+        
+        # Prefer totals computed by the query (TOTAL_SCORE_SQL), as score_property does
+        total_score = [
+            computed if p.total_score is None else p.total_score
+            for p, computed in zip(properties, computed_total)
+        ]
+        
+        if top_k is not None:
+            # Only build score objects for the properties that are kept
+            keep = heapq.nlargest(top_k, range(len(properties)), key=total_score.__getitem__)
+            properties, total_score, roi_score, condition_score, risk_score = (
+                [values[i] for i in keep]
+                for values in (properties, total_score, roi_score, condition_score, risk_score)
+            )
+        
+        return list(map(
+            InvestmentScore, properties, total_score, roi_score, repeat(location_score),
+            condition_score, repeat(market_score), risk_score
+        ))
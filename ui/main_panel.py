@@ -1,7 +1,56 @@
 from shiny import ui
-import folium
-from folium.plugins import HeatMap, MarkerCluster
+import base64
+import uuid
+import numpy as np
+import orjson
 from geopy.geocoders import Nominatim
+import logging
+
+log = logging.getLogger(__name__)
+
+# Heatmap color ramps (low to high) per metric
+HEATMAP_COLORS = {
+    'price': [[0, 0, 255], [0, 255, 0], [255, 255, 0], [255, 0, 0]],
+    'sqft': [[128, 0, 128], [0, 255, 255], [0, 128, 0], [255, 255, 0]],
+    'score': [[0, 0, 255], [0, 128, 0], [255, 255, 0], [255, 0, 0]],
+    'roi': [[0, 0, 255], [128, 0, 128], [255, 165, 0], [255, 0, 0]]
+}
+
+# Below this zoom level the heatmap is fed hexagonal cells aggregated on the server instead of raw points
+RAW_POINTS_ZOOM = 14
+
+# Hex cell radius in screen pixels at the requested zoom level
+HEX_RADIUS_PIXELS = 10
+
+
+def _hex_cells(lat, lon, weight, zoom):
+    """Sum weights into pointy-top hexagons sized for the zoom level; returns [lat, lon, weight] per cell"""
+    # Web Mercator pixel coordinates at this zoom
+    scale = 256 * 2 ** zoom
+    x = (lon + 180) / 360 * scale
+    phi = np.radians(lat)
+    y = (1 - np.log(np.tan(phi) + 1 / np.cos(phi)) / np.pi) / 2 * scale
+    
+    # Axial hex coordinates, rounded to the nearest cell in cube space
+    q = (np.sqrt(3) / 3 * x - y / 3) / HEX_RADIUS_PIXELS
+    r = (2 / 3 * y) / HEX_RADIUS_PIXELS
+    cx, cz = np.round(q), np.round(r)
+    cy = np.round(-q - r)
+    dx, dy, dz = np.abs(cx - q), np.abs(cy + q + r), np.abs(cz - r)
+    fix_x = (dx > dy) & (dx > dz)
+    fix_z = ~fix_x & (dz >= dy)
+    cx = np.where(fix_x, -cy - cz, cx)
+    cz = np.where(fix_z, -cx - cy, cz)
+    
+    # Cells sit at the mean position of their points, weighted by the total point weight
+    _, cell, count = np.unique(np.column_stack([cx, cz]), axis=0, return_inverse=True, return_counts=True)
+    cell = cell.ravel()
+    return np.column_stack([
+        np.bincount(cell, lat) / count,
+        np.bincount(cell, lon) / count,
+        np.bincount(cell, weight)
+    ])
+
 
 class MainPanel:
     @staticmethod
@@ -70,190 +119,56 @@ class MainPanel:
                 return location.latitude, location.longitude
                 
             # If geocoding fails, use a default location (Orange, CA)
-            print(f"Using default coordinates for ZIP: {zip_code}")
+            log.warning("Using default coordinates for ZIP: %s", zip_code)
             return ZIP_COORDINATES['92866']
             
         except Exception as e:
-            print(f"Error getting coordinates: {str(e)}")
+            log.warning("Error getting coordinates: %s", e)
             # Return default coordinates on error
             return ZIP_COORDINATES['92866']
 
     @staticmethod
-    def create_heatmap(center_zip, data_points, metric="price"):
-        """Create a folium heatmap with clickable markers centered on ZIP code"""
+    def create_heatmap(center_zip, points, metric="price", details_url=None, zoom=11):
+        """Create a deck.gl heatmap with hoverable markers centered on ZIP code"""
+        # points has one [lat, lon, weight, score] row per property; details_url, if given,
+        # serves the matching list of property details as JSON for the marker tooltips
         try:
+            points = np.asarray(points, dtype=np.float64).reshape(-1, 4)
+            weight = np.fmax(points[:, 2], 0)
+            if zoom >= RAW_POINTS_ZOOM:
+                cells = np.column_stack([points[:, 0], points[:, 1], weight])
+            else:
+                cells = _hex_cells(points[:, 0], points[:, 1], weight, zoom)
+            
             # Get center coordinates
             coordinates = MainPanel.get_coordinates(center_zip)
             if not coordinates:
-                if data_points:
-                    coordinates = (data_points[0][0], data_points[0][1])
+                if len(points):
+                    coordinates = (points[0, 0], points[0, 1])
                 else:
                     coordinates = (33.7879, -117.8531)
             
             latitude, longitude = coordinates
+            log.debug("Creating heatmap with %d points", len(points))
             
-            m = folium.Map(location=[latitude, longitude], 
-                          zoom_start=11,
-                          tiles='cartodbpositron',
-                          width='100%',
-                          height='400px')
-            
-            if data_points:
-                print(f"Processing {len(data_points)} data points")
-                
-                marker_cluster = MarkerCluster(name="Properties")
-                heatmap_data = []
-                
-                for point in data_points:
-                    lat, lon, intensity = point[:3]
-                    property_data = point[3] if len(point) > 3 else None
-                    
-                    heatmap_data.append([float(lat), float(lon), float(intensity)])
-                    
-                    if property_data:
-                        # Format values with error handling
-                        def safe_format(value, format_str="{:,.0f}"):
-                            try:
-                                return format_str.format(value) if value is not None else "N/A"
-                            except:
-                                return "N/A"
-                        
-                        # Calculate additional metrics
-                        price_per_sqft = property_data['price'] / property_data['sqft'] if property_data['price'] and property_data['sqft'] else None
-                        cap_rate = property_data.get('cap_rate', 0)
-                        monthly_mortgage = (property_data['price'] * 0.8 * 0.06 / 12) if property_data['price'] else None  # Rough estimate: 80% LTV, 6% rate
-                        
-                        # Create Google Maps link
-                        maps_url = f"https://www.google.com/maps/search/?api=1&query={lat},{lon}"
-                        
-                        # Enhanced popup content with more details
-                        popup_content = f"""
-                            <div style="font-family: Arial, sans-serif; min-width: 300px; max-width: 400px;">
-                                <h4 style="margin: 0 0 10px 0; color: #1a237e; border-bottom: 2px solid #eef2f7; padding-bottom: 5px;">
-                                    {property_data.get('address', 'N/A')}
-                                </h4>
-                                
-                                <div style="display: grid; grid-template-columns: 1fr 1fr; gap: 10px;">
-                                    <div style="margin: 5px 0;">
-                                        <b>Price:</b> ${safe_format(property_data.get('price'))}
-                                    </div>
-                                    <div style="margin: 5px 0;">
-                                        <b>Fair Price:</b> ${safe_format(property_data.get('fair_price'))}
-                                    </div>
-                                    <div style="margin: 5px 0;">
-                                        <b>Price Difference:</b> {property_data.get('price_diff')}
-                                    </div>
-                                    <div style="margin: 5px 0;">
-                                        <b>Difference %:</b> {property_data.get('price_diff_pct')}
-                                    </div>
-                                    
-                                    <div style="margin: 5px 0;">
-                                        <b>Type:</b> {property_data.get('type', 'N/A')}
-                                    </div>
-                                    
-                                    <div style="margin: 5px 0;">
-                                        <b>Square Feet:</b> {safe_format(property_data.get('sqft'))}
-                                    </div>
-                                    <div style="margin: 5px 0;">
-                                        <b>Price/Sqft:</b> ${safe_format(price_per_sqft, "{:.2f}")}
-                                    </div>
-                                    
-                                    <div style="margin: 5px 0;">
-                                        <b>Beds:</b> {safe_format(property_data.get('beds'))}
-                                    </div>
-                                    <div style="margin: 5px 0;">
-                                        <b>Baths:</b> {safe_format(property_data.get('baths'))}
-                                    </div>
-                                    
-                                    <div style="margin: 5px 0;">
-                                        <b>Year Built:</b> {safe_format(property_data.get('year_built'))}
-                                    </div>
-                                    <div style="margin: 5px 0;">
-                                        <b>Investment Score:</b> {safe_format(property_data.get('score'), "{:.1f}")}/10
-                                    </div>
-                                </div>
-                                
-                                <div style="margin-top: 10px; padding-top: 10px; border-top: 1px solid #eef2f7;">
-                                    <h5 style="margin: 0 0 5px 0; color: #1a237e;">Investment Analysis</h5>
-                                    <div style="display: grid; grid-template-columns: 1fr 1fr; gap: 10px;">
-                                        <div style="margin: 5px 0;">
-                                            <b>Monthly Rent:</b> ${safe_format(property_data.get('rent'))}
-                                        </div>
-                                        <div style="margin: 5px 0;">
-                                            <b>Cap Rate:</b> {safe_format(cap_rate, "{:.1f}")}%
-                                        </div>
-                                        
-                                        <div style="margin: 5px 0;">
-                                            <b>Est. Mortgage:</b> ${safe_format(monthly_mortgage)}
-                                        </div>
-                                        <div style="margin: 5px 0;">
-                                            <b>Cash Flow:</b> ${safe_format(property_data.get('rent', 0) - (monthly_mortgage or 0))}
-                                        </div>
-                                    </div>
-                                </div>
-                                
-                                <div style="margin-top: 10px; text-align: center;">
-                                    <a href="{maps_url}" target="_blank" style="
-                                        display: inline-block;
-                                        padding: 8px 16px;
-                                        background: #1a237e;
-                                        color: white;
-                                        text-decoration: none;
-                                        border-radius: 4px;
-                                        font-size: 14px;
-                                        margin-top: 5px;">
-                                        View on Google Maps 🗺️
-                                    </a>
-                                </div>
-                            </div>
-                        """
-                        
-                        # Create marker with custom icon
-                        icon = folium.Icon(
-                            color='red' if property_data.get('score', 0) >= 7 else 'orange',
-                            icon='home',
-                            prefix='fa'
-                        )
-                        
-                        # Add marker to cluster
-                        folium.Marker(
-                            location=[lat, lon],
-                            popup=folium.Popup(popup_content, max_width=400),
-                            icon=icon
-                        ).add_to(marker_cluster)
-                
-                # Add marker cluster to map
-                marker_cluster.add_to(m)
-                
-                # Add heatmap if we have data
-                if heatmap_data:
-                    print(f"Creating heatmap with {len(heatmap_data)} points")
-                    
-                    max_value = max(point[2] for point in heatmap_data)
-                    if max_value > 0:
-                        normalized_points = [[p[0], p[1], p[2]/max_value] for p in heatmap_data]
-                        
-                        HeatMap(
-                            normalized_points,
-                            name="Heatmap",
-                            min_opacity=0.3,
-                            max_zoom=18,
-                            radius=25,
-                            blur=15,
-                            gradient={
-                                'price': {0.4: 'blue', 0.65: 'lime', 0.85: 'yellow', 1: 'red'},
-                                'sqft': {0.4: 'purple', 0.65: 'cyan', 0.85: 'green', 1: 'yellow'},
-                                'score': {0.4: 'blue', 0.65: 'green', 0.85: 'yellow', 1: 'red'},
-                                'roi': {0.4: 'blue', 0.65: 'purple', 0.85: 'orange', 1: 'red'}
-                            }.get(metric, {0.4: 'blue', 0.65: 'lime', 0.85: 'yellow', 1: 'red'})
-                        ).add_to(m)
-                
-                folium.LayerControl().add_to(m)
-            
-            return m._repr_html_()
+            # The map script itself is the static www/heatmap.js; only its data changes per render
+            container = f"heatmap-{uuid.uuid4().hex}"
+            config = orjson.dumps({
+                'latitude': float(latitude),
+                'longitude': float(longitude),
+                'zoom': float(zoom),
+                'points': base64.b64encode(points[:, [0, 1, 3]].astype('<f4').tobytes()).decode('ascii'),
+                'cells': base64.b64encode(cells.astype('<f4').tobytes()).decode('ascii'),
+                'detailsUrl': details_url,
+                'colorRange': HEATMAP_COLORS.get(metric, HEATMAP_COLORS['price'])
+            }).decode()
+            return (
+                f'<div id="{container}" style="position: relative; width: 100%; height: 400px;"></div>'
+                f'<script>renderHeatmap("{container}", {config});</script>'
+            )
             
         except Exception as e:
-            print(f"Error creating heatmap: {str(e)}")
+            log.error("Error creating heatmap: %s", e)
             return f"<div>Error creating heatmap: {str(e)}</div>"
 
     @staticmethod
@@ -270,6 +185,7 @@ class MainPanel:
                         None,
                         choices={
                             "score": "Investment Score ↓",
+                            "total_score": "Overall Score ↓",
                             "roi_potential": "ROI Potential ↓",
                             "cap_rate": "Cap Rate ↓",
                             "price_asc": "Price (Low to High)",
@@ -0,0 +1,126 @@
+// deck.gl map: heatmap layer aggregated on the GPU plus a pickable marker layer for property details.
+// Markers ([lat, lon, score]) and heatmap cells ([lat, lon, weight]) arrive as base64 Float32 buffers;
+// details are fetched once, on the first hover, as one array per field. Rendered by MainPanel.create_heatmap.
+(function () {
+    const decode = b64 => new Float32Array(Uint8Array.from(atob(b64), c => c.charCodeAt(0)).buffer);
+
+    const missing = v => v === null || v === undefined || Number.isNaN(v);
+    const number = (v, digits) => missing(v) ? "N/A" : Number(v).toLocaleString("en-US", {minimumFractionDigits: digits, maximumFractionDigits: digits});
+    const money = v => missing(v) ? "N/A" : "$" + number(v, 0);
+    const escape = s => String(s).replace(/[&<>"]/g, c => ({"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;"}[c]));
+    const field = (label, value) => '<div style="margin: 5px 0;"><b>' + label + ':</b> ' + value + '</div>';
+
+    function tooltip(p) {
+        const pricePerSqft = p.price && p.sqft ? p.price / p.sqft : null;
+        const mortgage = p.price ? p.price * 0.8 * 0.06 / 12 : null;  // Rough estimate: 80% LTV, 6% rate
+        return '<div style="font-family: Arial, sans-serif; min-width: 300px; max-width: 400px;">'
+            + '<h4 style="margin: 0 0 10px 0; color: #1a237e; border-bottom: 2px solid #eef2f7; padding-bottom: 5px;">'
+            + escape(p.address || "N/A") + '</h4>'
+            + '<div style="display: grid; grid-template-columns: 1fr 1fr; gap: 10px;">'
+            + field("Price", money(p.price)) + field("Fair Price", money(p.fair_price))
+            + field("Price Difference", escape(p.price_diff || "N/A")) + field("Difference %", escape(p.price_diff_pct || "N/A"))
+            + field("Type", escape(p.type || "N/A")) + field("Square Feet", number(p.sqft, 0))
+            + field("Price/Sqft", missing(pricePerSqft) ? "N/A" : "$" + number(pricePerSqft, 2)) + field("Beds", number(p.beds, 0))
+            + field("Baths", number(p.baths, 0)) + field("Year Built", missing(p.year_built) ? "N/A" : String(Math.round(p.year_built)))
+            + field("Investment Score", number(p.score, 1) + "/10")
+            + '</div>'
+            + '<h5 style="margin: 10px 0 5px 0; color: #1a237e;">Investment Analysis</h5>'
+            + '<div style="display: grid; grid-template-columns: 1fr 1fr; gap: 10px;">'
+            + field("Monthly Rent", money(p.rent)) + field("Cap Rate", number(p.cap_rate, 1) + "%")
+            + field("Est. Mortgage", money(mortgage)) + field("Cash Flow", money((p.rent || 0) - (mortgage || 0)))
+            + '</div>'
+            + '<div style="margin-top: 10px; color: #666;">Click the marker to open Google Maps</div>'
+            + '</div>';
+    }
+
+    window.renderHeatmap = function (container, config) {
+        const values = decode(config.points);
+        const cellValues = decode(config.cells);
+        const points = {length: values.length / 3};
+        const cells = {length: cellValues.length / 3};
+        const position = (_, {index}) => [values[3 * index + 1], values[3 * index]];
+
+        // Details arrive as one array per field; a property's row is assembled on hover
+        const detailsUrl = config.detailsUrl;
+        let details = null;
+        function propertyDetails(index) {
+            if (details === null && detailsUrl) {
+                details = {};
+                fetch(detailsUrl).then(r => r.json()).then(d => { details = d; });
+            }
+            if (!details || !details.address || index >= details.address.length) {
+                return null;
+            }
+            const row = {};
+            for (const name in details) {
+                row[name] = details[name][index];
+            }
+            return row;
+        }
+
+        // A re-render for the same center (e.g. after a zoom change) keeps the user's current view
+        const center = config.latitude + "," + config.longitude;
+        const view = window.heatmapView && window.heatmapView.center === center
+            ? window.heatmapView
+            : {latitude: config.latitude, longitude: config.longitude, zoom: config.zoom};
+
+        // Only one map is live at a time; release the previous one's WebGL context
+        if (window.heatmapDeck) {
+            window.heatmapDeck.finalize();
+        }
+        window.heatmapDeck = new deck.DeckGL({
+            container: container,
+            initialViewState: {latitude: view.latitude, longitude: view.longitude, zoom: view.zoom},
+            controller: true,
+            // Report the zoom level so the next render can size its heatmap cells for it
+            onViewStateChange: ({viewState}) => {
+                window.heatmapView = {center: center, latitude: viewState.latitude, longitude: viewState.longitude, zoom: viewState.zoom};
+                if (window.Shiny) {
+                    Shiny.setInputValue("map_zoom", Math.round(viewState.zoom));
+                }
+            },
+            layers: [
+                new deck.TileLayer({
+                    id: "basemap",
+                    data: "https://basemaps.cartocdn.com/light_all/{z}/{x}/{y}.png",
+                    minZoom: 0,
+                    maxZoom: 19,
+                    tileSize: 256,
+                    renderSubLayers: props => {
+                        const box = props.tile.boundingBox;
+                        return new deck.BitmapLayer(props, {
+                            data: null,
+                            image: props.data,
+                            bounds: [box[0][0], box[0][1], box[1][0], box[1][1]]
+                        });
+                    }
+                }),
+                new deck.HeatmapLayer({
+                    id: "heatmap",
+                    data: cells,
+                    getPosition: (_, {index}) => [cellValues[3 * index + 1], cellValues[3 * index]],
+                    getWeight: (_, {index}) => cellValues[3 * index + 2],
+                    radiusPixels: 40,
+                    colorRange: config.colorRange
+                }),
+                new deck.ScatterplotLayer({
+                    id: "properties",
+                    data: points,
+                    pickable: true,
+                    getPosition: position,
+                    getRadius: 6,
+                    radiusUnits: "pixels",
+                    getFillColor: (_, {index}) => values[3 * index + 2] >= 7 ? [211, 47, 47] : [245, 124, 0],
+                    onClick: info => window.open("https://www.google.com/maps/search/?api=1&query=" + values[3 * info.index] + "," + values[3 * info.index + 1], "_blank")
+                })
+            ],
+            getTooltip: info => {
+                if (!info.layer || info.layer.id !== "properties") {
+                    return null;
+                }
+                const p = propertyDetails(info.index);
+                return p ? {html: tooltip(p), style: {backgroundColor: "white", color: "#333", padding: "10px", borderRadius: "4px"}} : null;
+            }
+        });
+    };
+})();
@@ -4,6 +4,7 @@ self.addEventListener('install', function(event) {
             return cache.addAll([
                 '/',
                 '/service.js',
+                '/heatmap.js',
                 '/styles.css'
             ]);
         })